@@ -1,11 +1,28 @@
 # app.py
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, Depends, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from model import recommend_by_id
-from semantic_search import search_products_by_text
-from utils import convert_keys_to_camel
+from typing import List, Optional
+from engine import get_registry, CatalogNotFound
+from artifacts import ARTIFACTS_DIR, load_at_startup as load_artifacts_at_startup
+from serialization import CamelJSONResponse, ndjson_line
+from metrics import stage, observe_request, inflight, render as render_metrics, METRICS_ENABLED
+from logger import get_logger, new_request_context, end_request_context
+from profiler import profile_request, profile_stream, run_session, ProfilerBusy
+from utils import encode_cursor, decode_cursor
+from model import PAGE_SIZE, DataSourceError
 from fastapi.middleware.cors import CORSMiddleware
-import traceback
+import hmac
+import os
+import time
+
+log = get_logger('app')
+
+# Similar-product index for /recommend/{id}: 'knn' (tag KNN + Gaussian rerank) or 'hybrid'
+RECOMMEND_INDEX = os.getenv('RECOMMEND_INDEX', 'knn')
+
+# Upper bound on the queries of one /recommend-by-text/batch request
+TEXT_BATCH_MAX_QUERIES = int(os.getenv('TEXT_BATCH_MAX_QUERIES', '10000'))
 
 app = FastAPI(
     title="Liquor Recommendation API",
@@ -25,35 +42,256 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+# Every catalog needs a build, a CSV file or a readable table: fail the startup otherwise
+@app.on_event("startup")
+def check_catalogs():
+    get_registry().check_sources()
+
+# Precomputed artifacts (python artifacts.py build): loaded read-only before serving
+@app.on_event("startup")
+def load_artifacts():
+    if ARTIFACTS_DIR:
+        versions = load_artifacts_at_startup()
+        log.info("Serving artifacts %s (%s)", ARTIFACTS_DIR,
+                 ', '.join(f"{key} {version}" for key, version in versions.items()))
+
+# Request latency + in-flight gauge (skipped entirely when metrics are disabled)
+if METRICS_ENABLED:
+    @app.middleware("http")
+    async def metrics_middleware(request: Request, call_next):
+        start = time.perf_counter()
+        inflight(1)
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            inflight(-1)
+            route = request.scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            observe_request(path, request.method, status, time.perf_counter() - start)
+
+# Per-request correlation id (X-Request-ID is reused when the caller sends one)
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    request_id, tokens = new_request_context(request.headers.get("x-request-id"))
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        end_request_context(tokens)
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
 # Pydantic model for request body
 class TextQueryRequest(BaseModel):
     query: str
     top_k: int = 5
 
+class BatchTextQueryRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+
+class FlavorProfileRequest(BaseModel):
+    f1: Optional[float] = None
+    f2: Optional[float] = None
+    f3: Optional[float] = None
+    f4: Optional[float] = None
+    f5: Optional[float] = None
+    f6: Optional[float] = None
+    top_k: int = 15
+    weights: Optional[List[float]] = None
+
+class MoreLikeTheseRequest(BaseModel):
+    liked_ids: List[int]
+    disliked_ids: List[int] = []
+    top_k: int = 5
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint (stage histograms, cache/queue/dataset gauges)"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/catalogs")
+def catalogs():
+    """Configured catalogs, which are loaded, and their memory use"""
+    return get_registry().status()
+
+@app.post("/admin/catalogs/{catalog}/unload", dependencies=[Depends(require_admin)])
+def unload_catalog(catalog: str):
+    """Free a catalog's memory; it is loaded again by its next request"""
+    try:
+        get_registry().unload(catalog)
+    except CatalogNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return get_registry().status()
+
+@app.get("/admin/memory", dependencies=[Depends(require_admin)])
+def admin_memory(columns: bool = False):
+    """Bytes per artifact (frame, tag/flavor matrices, indexes, embeddings) per catalog"""
+    return get_registry().memory_report(columns)
+
 @app.get("/recommend/{id_entry}")
-def recommend(id_entry: int):
+def recommend(id_entry: int, index: Optional[str] = None):
+    return catalog_recommend(None, id_entry, index)
+
+@app.get("/catalogs/{catalog}/recommend/{id_entry}")
+def catalog_recommend(catalog: Optional[str], id_entry: int, index: Optional[str] = None):
+    try:
+        log.debug("Received recommendation request for id: %s", id_entry)
+        index = index or RECOMMEND_INDEX
+        if index not in ('knn', 'hybrid'):
+            raise ValueError(f"Unknown index '{index}' (expected 'knn' or 'hybrid')")
+        with get_registry().use(catalog) as engine, profile_request('recommend'):
+            if index == 'hybrid':
+                result = engine.recommend_hybrid(id_entry)
+            else:
+                result = engine.recommend(id_entry)
+            # Convert keys to camelCase and encode once
+            with stage('serialize'):
+                response = CamelJSONResponse(result)
+        log.info("Successfully generated %d recommendations", len(result),
+                 extra={'route': 'recommend', 'product_id': id_entry})
+        return response
+    except CatalogNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except DataSourceError as e:
+        log.error("Data source unavailable: %s", e, extra={'route': 'recommend', 'product_id': id_entry})
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        log.warning("ValueError: %s", e, extra={'route': 'recommend', 'product_id': id_entry})
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        log.exception("Exception: %s", e, extra={'route': 'recommend', 'product_id': id_entry})
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@app.get("/recommend/{id_entry}/page")
+def recommend_page(id_entry: int, limit: Optional[int] = None, cursor: Optional[str] = None):
+    return catalog_recommend_page(None, id_entry, limit, cursor)
+
+@app.get("/catalogs/{catalog}/recommend/{id_entry}/page")
+def catalog_recommend_page(catalog: Optional[str], id_entry: int, limit: Optional[int] = None,
+                           cursor: Optional[str] = None):
+    """
+    Similar products one page at a time ("show more")
+
+    Query:
+        limit: page size (default RECOMMEND_PAGE_SIZE, at most RECOMMEND_MAX_PAGE_SIZE)
+        cursor: nextCursor of the previous page (keeps its page size unless limit is given)
+
+    Returns:
+        {
+            "results": [...],
+            "total": 97,
+            "nextCursor": "eyJpZCI6..." (null on the last page)
+        }
+
+    The first page with the default size is the /recommend/{id} response; the
+    ranking is computed once per product and dataset version, so later pages
+    are slices of it. A cursor from another dataset version is rejected (400).
+    """
+    extra = {'route': 'recommend-page', 'product_id': id_entry}
     try:
-        print(f"Received recommendation request for id: {id_entry}")
-        result = recommend_by_id(id_entry)
-        # Convert keys to camelCase before returning
-        converted = convert_keys_to_camel(result)
-        print(f"Successfully generated {len(converted)} recommendations")
-        return converted
+        with get_registry().use(catalog) as engine, profile_request('recommend'):
+            offset = 0
+            if cursor is not None:
+                state = decode_cursor(cursor)
+                engine.ensure_loaded()
+                if state.get('id') != id_entry or state.get('v') != engine.dataset_version \
+                        or not all(type(state.get(k)) is int for k in ('o', 'n')):
+                    raise ValueError("Cursor does not match this product or dataset version, "
+                                     "request the first page again")
+                offset = state['o']
+                if limit is None:
+                    limit = state['n']
+            if limit is None:
+                limit = PAGE_SIZE
+
+            result, total = engine.recommend_page(id_entry, offset, limit)
+            next_offset = offset + len(result)
+            next_cursor = None
+            if next_offset < total:
+                next_cursor = encode_cursor({'v': engine.dataset_version, 'id': id_entry,
+                                             'o': next_offset, 'n': limit})
+
+            with stage('serialize'):
+                response = CamelJSONResponse({
+                    "results": result,
+                    "total": total,
+                    "next_cursor": next_cursor
+                })
+        log.info("Successfully generated %d recommendations (offset %d)", len(result), offset,
+                 extra=extra)
+        return response
+    except CatalogNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except DataSourceError as e:
+        log.error("Data source unavailable: %s", e, extra=extra)
+        raise HTTPException(status_code=503, detail=str(e))
     except ValueError as e:
-        print(f"ValueError: {str(e)}")
-        print(traceback.format_exc())
+        log.warning("ValueError: %s", e, extra=extra)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"Exception: {str(e)}")
-        print(traceback.format_exc())
+        log.exception("Exception: %s", e, extra=extra)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@app.post("/recommend/more-like-these")
+def recommend_more_like_these(request: MoreLikeTheseRequest):
+    return catalog_more_like_these(None, request)
+
+@app.post("/catalogs/{catalog}/recommend/more-like-these")
+def catalog_more_like_these(catalog: Optional[str], request: MoreLikeTheseRequest):
+    """
+    Recommendations for several liked (and optionally disliked) products at once
+
+    Request body:
+        - liked_ids: Product IDs the user likes
+        - disliked_ids: Product IDs to steer away from (optional)
+        - top_k: Number of results (default: 5)
+    """
+    extra = {'route': 'more-like-these', 'liked': len(request.liked_ids),
+             'disliked': len(request.disliked_ids)}
+    try:
+        with get_registry().use(catalog) as engine, profile_request('more-like-these'):
+            result = engine.more_like_these(request.liked_ids, request.disliked_ids, request.top_k)
+            with stage('serialize'):
+                response = CamelJSONResponse(result)
+        log.info("Successfully generated %d recommendations", len(result), extra=extra)
+        return response
+    except CatalogNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except DataSourceError as e:
+        log.error("Data source unavailable: %s", e, extra=extra)
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        log.warning("ValueError: %s", e, extra=extra)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        log.exception("Exception: %s", e, extra=extra)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.post("/recommend-by-text")
 def recommend_by_text(request: TextQueryRequest):
+    return catalog_recommend_by_text(None, request)
+
+@app.post("/catalogs/{catalog}/recommend-by-text")
+def catalog_recommend_by_text(catalog: Optional[str], request: TextQueryRequest):
     """
     Recommend products based on natural language query using semantic search
     
@@ -66,30 +304,215 @@ def recommend_by_text(request: TextQueryRequest):
     Returns:
         {
             "query": "I want a sweet red wine",
-            "results": [...]
+            "results": [...],
+            "degraded": false,
+            "searchMode": "semantic"
         }
+
+    While the catalog embeddings are being (re)built, results come from the
+    previous embedding version ("stale_embeddings") or a lexical match over
+    names and tags ("lexical"), with "degraded": true.
     """
     try:
-        print(f"Received text query: {request.query}")
+        log.debug("Received text query: %s", request.query)
         
-        # Load product data
-        from model import load_data
-        df = load_data()
+        with get_registry().use(catalog) as engine, profile_request('recommend-by-text'):
+            # Search for matching products
+            with stage('search_products_by_text'):
+                result, mode = engine.search_text(request.query, request.top_k)
+
+            # Convert results to camelCase and encode once
+            with stage('serialize'):
+                response = CamelJSONResponse({
+                    "query": request.query,
+                    "results": result,
+                    "degraded": mode != "semantic",
+                    "search_mode": mode
+                })
+
+        log.info("Successfully generated %d recommendations", len(result),
+                 extra={'route': 'recommend-by-text', 'search_mode': mode})
+        return response
+    except CatalogNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except DataSourceError as e:
+        log.error("Data source unavailable: %s", e, extra={'route': 'recommend-by-text'})
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        log.warning("ValueError: %s", e, extra={'route': 'recommend-by-text'})
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        log.exception("Exception: %s", e, extra={'route': 'recommend-by-text'})
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-        # Search for matching products
-        result = search_products_by_text(request.query, df, request.top_k)
+@app.post("/recommend-by-text/batch")
+def recommend_by_text_batch(request: BatchTextQueryRequest):
+    return catalog_recommend_by_text_batch(None, request)
 
-        # Convert results to camelCase
-        converted = convert_keys_to_camel(result)
+@app.post("/catalogs/{catalog}/recommend-by-text/batch")
+def catalog_recommend_by_text_batch(catalog: Optional[str], request: BatchTextQueryRequest):
+    """
+    Semantic search for many queries at once, streamed as NDJSON
 
-        print(f"Successfully generated {len(converted)} recommendations")
-        return {
-            "query": request.query,
-            "results": converted
+    Request Body:
+        {
+            "queries": ["I want a sweet red wine", "dry and crisp"],
+            "top_k": 5
         }
+
+    Returns (application/x-ndjson), one line per query in request order:
+        {"index": 0, "query": "...", "results": [...], "degraded": false, "searchMode": "semantic"}
+
+    Queries are encoded in large batches and scored in chunks, and each line
+    is sent as soon as its chunk is ranked, so memory does not grow with the
+    batch. An error after the stream has started ends it with an
+    {"error": "..."} line.
+    """
+    extra = {'route': 'recommend-by-text-batch'}
+    queries = request.queries
+    if not queries:
+        raise HTTPException(status_code=400, detail="At least one query is required")
+    if len(queries) > TEXT_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {TEXT_BATCH_MAX_QUERIES} queries per request")
+    if request.top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k must be at least 1")
+    registry = get_registry()
+    try:
+        # Loaded before the stream starts, so a failure still gets its status code
+        with registry.use(catalog):
+            pass
+    except CatalogNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except DataSourceError as e:
+        log.error("Data source unavailable: %s", e, extra=extra)
+        raise HTTPException(status_code=503, detail=str(e))
+
+    def stream():
+        sent = 0
+        try:
+            # The catalog stays in use (not unloaded) until the last line is sent
+            with registry.use(catalog) as engine:
+                results, mode = engine.search_text_batch(queries, request.top_k)
+                for index, result in enumerate(results):
+                    with stage('serialize'):
+                        line = ndjson_line({
+                            "index": index,
+                            "query": queries[index],
+                            "results": result,
+                            "degraded": mode != "semantic",
+                            "search_mode": mode
+                        })
+                    sent += 1
+                    yield line
+            log.info("Streamed results for %d queries", sent, extra=dict(extra, search_mode=mode))
+        except Exception as e:
+            log.exception("Exception after %d queries: %s", sent, e, extra=extra)
+            yield ndjson_line({"error": f"Internal server error: {str(e)}"})
+
+    return StreamingResponse(profile_stream('recommend-by-text-batch', stream()),
+                             media_type="application/x-ndjson")
+
+
+@app.get("/embeddings/status")
+def embeddings_status():
+    return catalog_embeddings_status(None)
+
+@app.get("/catalogs/{catalog}/embeddings/status")
+def catalog_embeddings_status(catalog: Optional[str]):
+    """Progress of the catalog embedding build and how text queries are served"""
+    registry = get_registry()
+    try:
+        return registry.get(catalog or registry.default_key).embedding_status()
+    except CatalogNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.post("/admin/embeddings/rebuild", dependencies=[Depends(require_admin)])
+def rebuild_embeddings():
+    return rebuild_catalog_embeddings(None)
+
+@app.post("/admin/catalogs/{catalog}/embeddings/rebuild", dependencies=[Depends(require_admin)])
+def rebuild_catalog_embeddings(catalog: Optional[str]):
+    """Rebuild the catalog embeddings in the background (current ones keep serving)"""
+    try:
+        with get_registry().use(catalog) as engine:
+            started = engine.start_embedding_build(force=True)
+            status = engine.embedding_status()
+    except CatalogNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except DataSourceError as e:
+        log.error("Data source unavailable: %s", e)
+        raise HTTPException(status_code=503, detail=str(e))
+    if not started:
+        raise HTTPException(status_code=409, detail="An embedding build is already running")
+    return status
+
+
+@app.post("/search/flavor")
+def search_flavor(request: FlavorProfileRequest):
+    return catalog_search_flavor(None, request)
+
+@app.post("/catalogs/{catalog}/search/flavor")
+def catalog_search_flavor(catalog: Optional[str], request: FlavorProfileRequest):
+    """
+    Search products by flavor profile (cosine similarity over f1..f6)
+
+    Request Body:
+        {
+            "f1": 0.8, "f2": 0.3, "f3": 0.6, "f4": 0.7, "f5": 0.4, "f6": 0.5,
+            "top_k": 15,
+            "weights": [1, 1, 2, 1, 1, 1]   # optional, weighted-dimension mode
+        }
+
+    Missing f-values default to 0.5 (same as the Java flavor-profile search).
+    """
+    try:
+        user_vector = [request.f1, request.f2, request.f3,
+                       request.f4, request.f5, request.f6]
+        with get_registry().use(catalog) as engine, profile_request('search-flavor'):
+            result = engine.search_flavor(user_vector, request.top_k, request.weights)
+            with stage('serialize'):
+                return CamelJSONResponse(result)
+    except CatalogNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except DataSourceError as e:
+        log.error("Data source unavailable: %s", e, extra={'route': 'search-flavor'})
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        log.warning("ValueError: %s", e, extra={'route': 'search-flavor'})
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"Exception: {str(e)}")
-        print(traceback.format_exc())
+        log.exception("Exception: %s", e, extra={'route': 'search-flavor'})
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+def admin_profile(mode: str = "sampling", route: Optional[str] = None,
+                  duration: float = 10.0, requests: Optional[int] = None,
+                  interval: float = 0.005, output: str = "text"):
+    """
+    Profile this worker for `duration` seconds or the next `requests` requests
+
+    Query params:
+        mode: "sampling" -> collapsed stacks (flamegraph.pl / speedscope)
+              "cprofile" -> pstats text, or a marshalled pstats file with output=binary
+        route: "recommend", "more-like-these", "recommend-by-text",
+               "recommend-by-text-batch" or "search-flavor" (default: all)
+
+    Header: X-Admin-Token
+    """
+    try:
+        session = run_session(mode, route, duration, requests, interval)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    log.info("Profiling session finished", extra=session.summary())
+    headers = {f"X-Profile-{k.replace('_', '-')}": str(v) for k, v in session.summary().items()}
+    if mode == "sampling":
+        return Response(content=session.collapsed(), media_type="text/plain", headers=headers)
+    if output == "binary":
+        return Response(content=session.pstats_dump(), media_type="application/octet-stream",
+                        headers=headers)
+    return Response(content=session.pstats_text(), media_type="text/plain", headers=headers)
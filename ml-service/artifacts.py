@@ -0,0 +1,364 @@
+# artifacts.py
+"""
+Offline build of the derived artifacts, loaded read-only by the service.
+
+    python artifacts.py build                   # default catalog -> artifacts/sake/<version>/
+    python artifacts.py build --catalog wine    # a catalog from data/catalogs.json
+    python artifacts.py build --mode parallel --workers 8
+    python artifacts.py verify artifacts/sake   # the CURRENT build, or a build directory
+
+A build reads the DB/CSV, cleans the data and writes, into a temporary
+directory:
+
+    catalog.pkl         cleaned DataFrame (lean dtypes are applied at load time)
+    tag_matrix.npz      binary brand/tag matrix; tag_vocab.json its columns
+    flavor_matrix.npy   raw f1..f6 (product nulls = 0.0)
+    neighbors.npy       KNN candidates per product (model.compute_neighbor_table)
+    descriptions.json   texts the embeddings were encoded from
+    embeddings.npy      float32 sentence embeddings
+    manifest.json       dataset version, source, model, rows, sha256 + size per file
+
+Only a complete, verified build is renamed to <root>/<catalog>/<version>/ and
+then pointed to by <root>/<catalog>/CURRENT, so a failed build never replaces
+what the service loads. With ARTIFACTS_DIR set, the service loads the CURRENT
+build of every catalog at startup (checksums verified once, .npy files
+memory-mapped read-only) and builds nothing in-process.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import model
+from logger import get_logger
+from utils import atomic_write
+
+log = get_logger('artifacts')
+
+ARTIFACTS_DIR = os.getenv('ARTIFACTS_DIR')  # unset: build everything lazily in-process
+DEFAULT_OUT = 'artifacts'
+FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+CURRENT_FILE = 'CURRENT'
+
+_verified = {}  # (build directory, manifest mtime) -> manifest
+
+
+class ArtifactError(Exception):
+    """Missing, incomplete or corrupted artifact directory"""
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def catalog_source(catalog):
+    """(table, csv_path) of a catalog: the default one or data/catalogs.json"""
+    from engine import DEFAULT_CATALOG, load_catalog_config
+    if catalog == DEFAULT_CATALOG:
+        return 'products', "data/liquors.csv"
+    options = load_catalog_config().get(catalog)
+    if options is None:
+        raise ArtifactError(f"Catalog '{catalog}' not found in the catalogs config")
+    return options.get('table'), options.get('csv')
+
+
+def _progress_logger(what):
+    state = {'step': -1}
+
+    def progress(done, total):
+        step = done * 10 // max(total, 1)
+        if step != state['step']:
+            state['step'] = step
+            log.info("%s: %d/%d", what, done, total)
+    return progress
+
+
+def _encode(descriptions, work_dir, mode, parallel_options):
+    import semantic_search
+    if mode == 'parallel':
+        from parallel_embeddings import build_embeddings_parallel
+        options = {k: v for k, v in (parallel_options or {}).items() if v is not None}
+        dim = semantic_search.load_semantic_model().get_sentence_embedding_dimension()
+        return build_embeddings_parallel(
+            descriptions, semantic_search.MODEL_NAME, dim,
+            build_dir=os.path.join(work_dir, 'encode'),
+            progress=_progress_logger('Embeddings'), **options)
+    return semantic_search.encode_descriptions(descriptions, _progress_logger('Embeddings'))
+
+
+# ===== Build =====
+def build(catalog=None, root=None, embeddings=True, neighbors=True,
+          mode='serial', parallel_options=None, csv_fallback=False):
+    """Run the whole pipeline into <root>/<catalog>/<version>/ and point CURRENT at it
+
+    A catalog with a table fails the build when the table cannot be read,
+    unless csv_fallback allows reading its CSV file instead.
+    Returns the build directory.
+    """
+    from engine import DEFAULT_CATALOG
+    catalog = catalog or DEFAULT_CATALOG
+    root = root or ARTIFACTS_DIR or DEFAULT_OUT
+    table, csv_path = catalog_source(catalog)
+    catalog_dir = os.path.join(root, catalog)
+    os.makedirs(catalog_dir, exist_ok=True)
+    started = time.time()
+
+    log.info("Building artifacts for catalog %s", catalog)
+    raw, source_type = model.read_source(table, csv_path, csv_fallback)
+    source = _describe_source(source_type, table, csv_path, len(raw))
+    df = model.prepare_dataset(raw)
+    version = model.compute_dataset_version(df)
+    work_dir = os.path.join(catalog_dir, f'.build-{version}-{os.getpid()}')
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+
+    try:
+        files = []
+
+        def write(name, writer):
+            path = os.path.join(work_dir, name)
+            writer(path)
+            files.append(name)
+
+        write('catalog.pkl', lambda p: df.to_pickle(p))
+
+        tag_matrix, tag_vocab = model.compute_tag_matrix(df)
+        write('tag_matrix.npz', lambda p: sparse.save_npz(p, tag_matrix))
+        write('tag_vocab.json', lambda p: _write_json(p, list(tag_vocab)))
+
+        from flavor_search import compute_flavor_matrix
+        write('flavor_matrix.npy', lambda p: np.save(p, compute_flavor_matrix(df)[0]))
+
+        if neighbors:
+            neighbor_table = model.compute_neighbor_table(df, (tag_matrix, tag_vocab),
+                                                          _progress_logger('Neighbor table'))
+            write('neighbors.npy', lambda p: np.save(p, neighbor_table))
+
+        model_name = None
+        if embeddings:
+            import semantic_search
+            model_name = semantic_search.MODEL_NAME
+            descriptions = semantic_search.build_descriptions(df)
+            write('descriptions.json', lambda p: _write_json(p, descriptions))
+            matrix = np.asarray(_encode(descriptions, work_dir, mode, parallel_options), dtype=np.float32)
+            write('embeddings.npy', lambda p: np.save(p, matrix))
+            shutil.rmtree(os.path.join(work_dir, 'encode'), ignore_errors=True)
+
+        manifest = {
+            'format': FORMAT_VERSION,
+            'catalog': catalog,
+            'dataset_version': version,
+            'rows': len(df),
+            'source': source,
+            'model': model_name,
+            'neighbors': {'k': model.NEIGHBORS_K, 'n_liquors': model.NEIGHBORS_N_LIQUORS} if neighbors else None,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'build_seconds': round(time.time() - started, 1),
+            'files': {
+                name: {'sha256': sha256_file(os.path.join(work_dir, name)),
+                       'bytes': os.path.getsize(os.path.join(work_dir, name))}
+                for name in files
+            },
+        }
+        _write_json(os.path.join(work_dir, MANIFEST_FILE), manifest)
+        verify(work_dir)
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+    # Publish: rename the finished build into place, then switch CURRENT
+    final_dir = os.path.join(catalog_dir, version)
+    if os.path.exists(final_dir):
+        previous = f'{final_dir}.old-{os.getpid()}'
+        os.replace(final_dir, previous)
+        os.replace(work_dir, final_dir)
+        shutil.rmtree(previous, ignore_errors=True)
+    else:
+        os.replace(work_dir, final_dir)
+    with atomic_write(os.path.join(catalog_dir, CURRENT_FILE), 'w') as f:
+        f.write(version + '\n')
+    log.info("Artifacts for %s written to %s (%d files, %.1fs)",
+             catalog, final_dir, len(manifest['files']), manifest['build_seconds'])
+    return final_dir
+
+
+def _describe_source(source_type, table, csv_path, rows):
+    """Manifest entry for the source a build actually read"""
+    if source_type == 'table':
+        return {'type': 'table', 'table': table, 'rows': rows}
+    source = {'type': 'csv', 'csv': csv_path, 'rows': rows, 'sha256': sha256_file(csv_path)}
+    if table is not None:
+        source['fallback_from'] = table
+        log.warning("Table %s could not be read, built from %s", table, csv_path)
+    return source
+
+
+def _write_json(path, content):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(content, f, ensure_ascii=False)
+
+
+# ===== Verify & load =====
+def resolve(path):
+    """A build directory, or the CURRENT build of a catalog directory"""
+    current = os.path.join(path, CURRENT_FILE)
+    if os.path.exists(current):
+        with open(current) as f:
+            return os.path.join(path, f.read().strip())
+    return path
+
+
+def verify(path):
+    """Check that every file in the manifest exists with its checksum; returns the manifest"""
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ArtifactError(f"Cannot read {manifest_path}: {e}")
+    if manifest.get('format') != FORMAT_VERSION:
+        raise ArtifactError(f"{path}: unsupported artifact format {manifest.get('format')}")
+    for name, meta in manifest['files'].items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path):
+            raise ArtifactError(f"{path}: missing {name}")
+        if os.path.getsize(file_path) != meta['bytes'] or sha256_file(file_path) != meta['sha256']:
+            raise ArtifactError(f"{path}: checksum mismatch for {name}")
+    return manifest
+
+
+def verified_manifest(path):
+    """verify(path), once per published build
+
+    A build directory is never modified after it is published (a rebuild of
+    the same version replaces it with a new manifest), so a catalog that is
+    unloaded and loaded again does not re-hash its files.
+    """
+    try:
+        key = (path, os.stat(os.path.join(path, MANIFEST_FILE)).st_mtime_ns)
+    except OSError:
+        return verify(path)  # raises the ArtifactError
+    manifest = _verified.get(key)
+    if manifest is None:
+        manifest = verify(path)
+        _verified[key] = manifest
+    return manifest
+
+
+def load(path):
+    """Load a verified build read-only; returns a dict of artifacts"""
+    path = resolve(path)
+    manifest = verified_manifest(path)
+    files = manifest['files']
+
+    def npy(name):
+        return np.load(os.path.join(path, name), mmap_mode='r') if name in files else None
+
+    df = pd.read_pickle(os.path.join(path, 'catalog.pkl'))
+    if len(df) != manifest['rows']:
+        raise ArtifactError(f"{path}: catalog has {len(df)} rows, manifest says {manifest['rows']}")
+    with open(os.path.join(path, 'tag_vocab.json'), encoding='utf-8') as f:
+        tag_vocab = {label: i for i, label in enumerate(json.load(f))}
+    if model.MEMORY_LEAN:
+        df = model.compact_frame(df)
+
+    log.info("Loaded artifacts %s (catalog %s, version %s, %d rows)",
+             path, manifest['catalog'], manifest['dataset_version'], manifest['rows'])
+    return {
+        'path': path,
+        'manifest': manifest,
+        'df': df,
+        'dataset_version': manifest['dataset_version'],
+        'tag_matrix': sparse.load_npz(os.path.join(path, 'tag_matrix.npz')).tocsr(),
+        'tag_vocab': tag_vocab,
+        'flavor_matrix': npy('flavor_matrix.npy'),
+        'neighbors': npy('neighbors.npy'),
+        'embeddings': npy('embeddings.npy'),
+    }
+
+
+def flavor_matrices(raw):
+    """(raw, squared, normalized) from the stored raw flavor matrix"""
+    norms = np.linalg.norm(raw, axis=1, keepdims=True)
+    return raw, raw * raw, np.divide(raw, norms, out=np.zeros(raw.shape, dtype=np.float32), where=norms > 0)
+
+
+def load_at_startup():
+    """Verify and load the CURRENT build of every configured catalog (ARTIFACTS_DIR)
+
+    The default catalog must have one; catalogs without a build load from
+    their source on first use. Returns {catalog: dataset version}, or None
+    without ARTIFACTS_DIR.
+    """
+    from engine import get_registry
+    if not ARTIFACTS_DIR:
+        return None
+    registry = get_registry()
+    if find_catalog(registry.default_key) is None:
+        raise ArtifactError(f"No CURRENT build for catalog {registry.default_key} in {ARTIFACTS_DIR}")
+    versions = {}
+    for key in registry.keys():
+        if find_catalog(key) is None:
+            log.info("No artifacts for catalog %s, it loads from its source on first use", key)
+            continue
+        # Through the registry, so the catalogs memory budget still applies
+        with registry.use(key) as engine:
+            versions[key] = engine.dataset_version
+    return versions
+
+
+def find_catalog(catalog, root=None):
+    """Build directory of a catalog's CURRENT artifacts, or None"""
+    root = root or ARTIFACTS_DIR
+    if not root:
+        return None
+    path = os.path.join(root, catalog)
+    return path if os.path.exists(os.path.join(path, CURRENT_FILE)) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or verify the offline serving artifacts")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    build_cmd = sub.add_parser('build', help="Run the pipeline into a versioned artifact directory")
+    build_cmd.add_argument('--catalog', help="Catalog key (default: DEFAULT_CATALOG)")
+    build_cmd.add_argument('--out', help=f"Artifact root (default: ARTIFACTS_DIR or {DEFAULT_OUT})")
+    build_cmd.add_argument('--mode', choices=['serial', 'parallel'], default='serial',
+                           help="Embedding build mode")
+    build_cmd.add_argument('--workers', type=int, default=None)
+    build_cmd.add_argument('--threads-per-worker', type=int, default=None)
+    build_cmd.add_argument('--no-embeddings', action='store_true')
+    build_cmd.add_argument('--no-neighbors', action='store_true')
+    build_cmd.add_argument('--csv-fallback', action='store_true',
+                           help="Build from the catalog's CSV file when its table cannot be read")
+
+    verify_cmd = sub.add_parser('verify', help="Check a build's checksums")
+    verify_cmd.add_argument('path', help="Build directory, or a catalog directory (uses CURRENT)")
+    args = parser.parse_args()
+
+    if args.command == 'verify':
+        path = resolve(args.path)
+        manifest = verify(path)
+        print(f"OK {path}: {manifest['catalog']} {manifest['dataset_version']}, "
+              f"{manifest['rows']} rows, {len(manifest['files'])} files")
+        return
+
+    build(args.catalog, args.out, embeddings=not args.no_embeddings,
+          neighbors=not args.no_neighbors, mode=args.mode,
+          parallel_options={'workers': args.workers, 'threads_per_worker': args.threads_per_worker},
+          csv_fallback=args.csv_fallback)
+
+
+if __name__ == "__main__":
+    main()
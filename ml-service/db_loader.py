@@ -1,27 +1,49 @@
 # db_loader.py
 import pandas as pd
 import psycopg2
+from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 import os
 from dotenv import load_dotenv
+from logger import get_logger
+
+log = get_logger('db_loader')
 
 # Load environment variables
 load_dotenv()
 
-def load_data_from_db():
-    """Load product data from PostgreSQL database"""
+def connect():
+    """Connection to the products database (parameters from the environment)"""
+    return psycopg2.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        port=int(os.getenv('DB_PORT', 5433)),
+        database=os.getenv('DB_NAME', 'testdb'),
+        user=os.getenv('DB_USER', 'postgres'),
+        password=os.getenv('DB_PASSWORD', '123456')
+    )
+
+def check_table(table):
+    """Raise if the products table cannot be read"""
+    conn = connect()
     try:
-        # Database connection parameters from environment
-        conn = psycopg2.connect(
-            host=os.getenv('DB_HOST', 'localhost'),
-            port=int(os.getenv('DB_PORT', 5433)),
-            database=os.getenv('DB_NAME', 'testdb'),
-            user=os.getenv('DB_USER', 'postgres'),
-            password=os.getenv('DB_PASSWORD', '123456')
-        )
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("SELECT 1 FROM {} LIMIT 1").format(sql.Identifier(table)))
+    finally:
+        conn.close()
+
+def load_data_from_db(table='products', csv_path="data/liquors.csv", csv_fallback=True):
+    """Load product data from PostgreSQL database
+
+    Args:
+        table: Products table (one per catalog)
+        csv_path: CSV file to fall back to when the database is unreachable
+        csv_fallback: False to raise instead of reading csv_path
+    """
+    try:
+        conn = connect()
         
         # SQL query to get all products
-        query = """
+        query = sql.SQL("""
             SELECT 
                 id,
                 name,
@@ -36,23 +58,24 @@ def load_data_from_db():
                 checkin_count,
                 pictures,
                 similar_brands
-            FROM products
+            FROM {}
             ORDER BY id
-        """
+        """).format(sql.Identifier(table)).as_string(conn)
         
         # Load data into pandas DataFrame
         df = pd.read_sql_query(query, conn)
         
         conn.close()
         
-        print(f"Loaded {len(df)} products from database")
+        log.info("Loaded %d products from database", len(df))
         return df
         
     except Exception as e:
-        print(f"Error loading from database: {e}")
-        print("Falling back to CSV file...")
+        if not csv_fallback:
+            raise
+        log.warning("Error loading from database: %s. Falling back to CSV file...", e)
         # Fallback to CSV if database connection fails
-        df = pd.read_csv("data/liquors.csv")
+        df = pd.read_csv(csv_path)
         return df
 
 def get_product_by_id(product_id):
@@ -79,5 +102,5 @@ def get_product_by_id(product_id):
         return df.iloc[0]
         
     except Exception as e:
-        print(f"Error getting product: {e}")
+        log.error("Error getting product: %s", e)
         raise
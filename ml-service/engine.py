@@ -0,0 +1,672 @@
+# engine.py
+"""
+Multi-catalog serving: one Recommender per catalog, routed by catalog key.
+
+A Recommender owns one catalog's data, indexes and caches (tag and flavor
+matrices, hybrid index, lexical index, text embeddings). The
+sentence-transformers encoder is shared by every catalog
+(semantic_search.load_semantic_model).
+
+Catalogs are declared in CATALOGS_CONFIG (JSON):
+    {
+        "wine":   {"csv": "data/wine.csv"},
+        "whisky": {"table": "whisky_products", "csv": "data/whisky.csv",
+                   "memory_budget_mb": 256}
+    }
+
+The default catalog (DEFAULT_CATALOG, served by the routes without a
+catalog prefix) is always present and pinned (never unloaded). The
+module-level API of model.py / flavor_search.py / hybrid_index.py /
+semantic_search.py (load_data, recommend_by_id, search_products_by_text, ...)
+is a thin wrapper over it (default_engine()).
+
+Memory:
+    - memory_budget_mb (per catalog, default CATALOG_MEMORY_BUDGET_MB): over
+      budget, the catalog drops its derived indexes (hybrid, lexical) except
+      the one the current request has just built; they are rebuilt on demand.
+    - CATALOGS_MEMORY_BUDGET_MB (whole process): after a catalog is used,
+      idle catalogs are unloaded least-recently-used first until the loaded
+      catalogs fit. 0 disables either limit.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from sklearn.preprocessing import normalize
+
+import model
+import artifacts
+import flavor_search
+import hybrid_index
+import semantic_search
+from metrics import stage, set_dataset, set_cache_entries
+from logger import get_logger
+from utils import SingleFlight
+
+log = get_logger('engine')
+
+CATALOGS_CONFIG = os.getenv('CATALOGS_CONFIG', 'data/catalogs.json')
+DEFAULT_CATALOG = os.getenv('DEFAULT_CATALOG', 'sake')
+CATALOG_MEMORY_BUDGET_MB = float(os.getenv('CATALOG_MEMORY_BUDGET_MB', '0'))
+CATALOGS_MEMORY_BUDGET_MB = float(os.getenv('CATALOGS_MEMORY_BUDGET_MB', '0'))
+CATALOGS_DIR = 'data/catalogs'  # per-catalog embedding caches
+
+MB = 1024 * 1024
+
+
+class CatalogNotFound(LookupError):
+    """Unknown catalog key"""
+
+
+def nbytes(obj):
+    """Approximate memory of an artifact (DataFrame, ndarray, sparse matrix, index tuple)"""
+    if obj is None:
+        return 0
+    if hasattr(obj, 'memory_usage'):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if hasattr(obj, 'indptr'):
+        return int(obj.data.nbytes + obj.indices.nbytes + obj.indptr.nbytes)
+    if hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sum(nbytes(v) for v in obj.values())
+    if isinstance(obj, (tuple, list)):
+        return sum(nbytes(v) for v in obj)
+    return 0
+
+
+def encoder_bytes():
+    """Parameter memory of the shared sentence-transformers model (0 until loaded)"""
+    encoder = semantic_search.model
+    if encoder is None or not hasattr(encoder, 'parameters'):
+        return 0
+    return int(sum(p.numel() * p.element_size() for p in encoder.parameters()))
+
+
+def process_memory():
+    """Resident and peak resident set size of this worker, in bytes"""
+    report = {}
+    try:
+        with open('/proc/self/statm') as f:
+            report['rss'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # ru_maxrss is in KiB on Linux
+        report['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        pass
+    return report
+
+
+class Recommender:
+    """Data, indexes and caches of one catalog"""
+
+    def __init__(self, key, table=None, csv_path=None, embeddings_cache=None,
+                 memory_budget_mb=None, pinned=False):
+        self.key = key
+        self.table = table
+        self.csv_path = csv_path
+        self.embeddings_cache = embeddings_cache or os.path.join(
+            CATALOGS_DIR, key, 'embeddings_cache.pkl')
+        budget = CATALOG_MEMORY_BUDGET_MB if memory_budget_mb is None else memory_budget_mb
+        self.memory_budget = int(budget * MB)
+        self.pinned = pinned     # the default catalog: never unloaded
+
+        self.df = None
+        self.dataset_version = None
+        self.manifest = None     # artifact manifest when loaded from a build
+        self.tag_features = None  # (binary CSR tag matrix, vocab) for the KNN
+        self.neighbors = None    # precomputed KNN candidates (artifacts only)
+        self.tags = None         # row-normalized CSR tag matrix
+        self.flavors = None      # (raw, squared, normalized) flavor matrices
+        self.embeddings = None   # row-normalized text embeddings of df
+        self.stale = None        # (embeddings, rows): previous version, served while a rebuild runs
+        self.hybrid = None       # compute_hybrid_index output
+        self.lexical = None      # compute_lexical_index output
+        self.rankings = model.RankingCache(f'rankings:{key}')  # pagination
+        self._sizes = {}
+        self._over_budget = False
+        self._cache_checked = False
+        # Guards _sizes and the derived indexes they describe (budget eviction)
+        self._lock = threading.RLock()
+
+        # Embedding builds; kept across unloads so a running build stays visible
+        self.build_status = {
+            'state': 'idle',  # idle | building | ready | failed
+            'done': 0,
+            'total': 0,
+            'started_at': None,
+            'finished_at': None,
+            'error': None,
+        }
+        self._status_lock = threading.Lock()
+
+        self.in_use = 0
+        self.last_used = 0.0
+        self._flight = SingleFlight()
+
+    # ===== Lifecycle =====
+    @property
+    def loaded(self):
+        return self.df is not None
+
+    def ensure_loaded(self):
+        if self.df is None:
+            self._flight.do('load', lambda: self.df if self.df is not None else self._load())
+        return self.df
+
+    def _load(self):
+        log.info("Loading catalog %s", self.key)
+        path = artifacts.find_catalog(self.key)
+        if path is not None:
+            self._load_artifacts(path)
+        else:
+            with stage('load_data'):
+                df = model.read_dataset(self.table, self.csv_path)
+                version = model.compute_dataset_version(df)
+                if model.MEMORY_LEAN:
+                    df = model.compact_frame(df)
+            self.tag_features = model.compute_tag_matrix(df)
+            self.tags = normalize(self.tag_features[0])
+            self.flavors = flavor_search.compute_flavor_matrix(df)
+            self.dataset_version = version
+            self.df = df
+        df = self.df
+        if self.pinned:
+            set_dataset(self.dataset_version, len(df))
+        set_cache_entries(f'flavor_matrix:{self.key}', len(df))
+        with self._lock:
+            self._sizes = {'frame': nbytes(df),
+                           'tag_features': nbytes(self.tag_features[0]) + nbytes(self.tags),
+                           'flavor_matrix': nbytes(self.flavors),
+                           'neighbors': nbytes(self.neighbors),
+                           'embeddings': nbytes(self.embeddings)}
+            log.info("Catalog %s loaded: %d products, version %s, %.1f MB",
+                     self.key, len(df), self.dataset_version, self.memory_bytes() / MB)
+            self._enforce_budget()
+        return df
+
+    def _load_artifacts(self, path):
+        """Everything precomputed by `python artifacts.py build --catalog <key>`"""
+        loaded = artifacts.load(path)
+        df = loaded['df']
+        self.tag_features = (loaded['tag_matrix'], loaded['tag_vocab'])
+        self.tags = normalize(loaded['tag_matrix'])
+        self.flavors = artifacts.flavor_matrices(loaded['flavor_matrix'])
+        self.neighbors = loaded['neighbors']
+        self.dataset_version = loaded['dataset_version']
+        self.manifest = loaded['manifest']
+        if loaded['embeddings'] is not None:
+            self.embeddings = semantic_search.normalized_rows(loaded['embeddings'])
+            self._cache_checked = True
+            set_cache_entries(f'embeddings:{self.key}', len(df))
+            with self._status_lock:
+                self.build_status.update(state='ready', done=len(df), total=len(df),
+                                         finished_at=time.time())
+        self.df = df
+
+    def check_source(self):
+        """Raise model.DataSourceError unless the catalog has a build, a CSV file or a readable table"""
+        if artifacts.find_catalog(self.key) is None:
+            model.check_source(self.table, self.csv_path)
+
+    def unload(self):
+        """Drop everything; the next request loads the catalog again"""
+        if self.pinned:
+            raise ValueError(f"Catalog {self.key} is the default catalog and cannot be unloaded")
+        with self._lock:
+            self.df = self.dataset_version = self.manifest = None
+            self.tag_features = self.tags = self.flavors = self.neighbors = None
+            self.embeddings = self.stale = self.hybrid = self.lexical = None
+            self.rankings.clear()
+            self._cache_checked = self._over_budget = False
+            self._sizes = {}
+        log.info("Catalog %s unloaded", self.key)
+
+    def memory_report(self):
+        """Bytes per artifact"""
+        with self._lock:
+            report = dict(self._sizes)
+        if self.rankings.nbytes:
+            report['rankings'] = self.rankings.nbytes
+        return report
+
+    def memory_bytes(self):
+        return sum(self.memory_report().values())
+
+    def _enforce_budget(self, keep=None):
+        """Over budget: drop the derived indexes, they are rebuilt on demand
+
+        keep: the artifact the current call has just built (never dropped)
+        """
+        with self._lock:
+            over_budget = bool(self.memory_budget) and self.memory_bytes() > self.memory_budget
+            if over_budget:
+                for name, attr in (('hybrid_index', 'hybrid'), ('lexical_index', 'lexical')):
+                    if name != keep and self._sizes.pop(name, None) is not None:
+                        setattr(self, attr, None)
+                over_budget = self.memory_bytes() > self.memory_budget
+            if over_budget and not self._over_budget:
+                log.warning("Catalog %s uses %.1f MB, over its %.1f MB budget",
+                            self.key, self.memory_bytes() / MB, self.memory_budget / MB)
+            self._over_budget = over_budget
+
+    def _remember(self, name, artifact):
+        """Record the size of an artifact; callers set the attribute under the same lock"""
+        with self._lock:
+            self._sizes[name] = nbytes(artifact)
+            self._enforce_budget(keep=name)
+
+    def status(self):
+        return {
+            'catalog': self.key,
+            'loaded': self.loaded,
+            'pinned': self.pinned,
+            'rows': len(self.df) if self.df is not None else 0,
+            'dataset_version': self.dataset_version,
+            'memory_bytes': self.memory_bytes(),
+            'memory_budget_bytes': self.memory_budget or None,
+            'embeddings': self.serving_mode(),
+            'embedding_build': self.build_status['state'],
+            'in_use': self.in_use,
+            'idle_seconds': round(time.monotonic() - self.last_used, 1) if self.last_used else None,
+        }
+
+    # ===== Text embeddings (shared encoder, per-catalog cache) =====
+    def _publish_embeddings(self, df, embeddings):
+        """Serve embeddings of df, replacing the stale version; returns them normalized"""
+        embeddings = semantic_search.normalized_rows(embeddings)
+        with self._lock:
+            published = self.df is df  # not unloaded/reloaded meanwhile
+            if published:
+                self.embeddings, self.stale, self.hybrid = embeddings, None, None
+                self._sizes.pop('hybrid_index', None)
+                self._sizes.pop('stale_embeddings', None)
+                self._remember('embeddings', embeddings)
+        if published:
+            set_cache_entries(f'embeddings:{self.key}', len(embeddings))
+        return embeddings
+
+    def _load_cached_embeddings(self, df):
+        """Serve the embedding cache file if it matches df (checked once per load).
+
+        A cache that no longer matches (catalog changed) is kept as the stale
+        version for the products that still exist. Returns True when current
+        embeddings are available.
+        """
+        if self.embeddings is not None:
+            return True
+        if self._cache_checked:
+            return False
+        self._cache_checked = True
+
+        embeddings, previous = semantic_search.match_embeddings_cache(self.embeddings_cache, df)
+        if embeddings is not None:
+            self._publish_embeddings(df, embeddings)
+            log.info("Embeddings of catalog %s loaded from %s", self.key, self.embeddings_cache)
+            return True
+        if previous is not None and self.df is df:
+            stale_embeddings, keep = previous
+            stale = (semantic_search.normalized_rows(stale_embeddings), df[keep])
+            with self._lock:
+                self.stale = stale
+                self._remember('stale_embeddings', stale)
+            log.info("Keeping previous embeddings of catalog %s for %d products until the "
+                     "rebuild finishes", self.key, int(keep.sum()))
+        return False
+
+    def _build_embeddings(self, df, progress=None, mode=None, parallel_options=None):
+        """Encode every product of df, write the cache file and serve the result"""
+        log.info("Creating product descriptions for catalog %s...", self.key)
+        with stage('build_descriptions'):
+            descriptions = semantic_search.build_descriptions(df)
+        build_dir = os.path.join(os.path.dirname(self.embeddings_cache) or '.', 'embeddings_build')
+        with stage('encode_catalog'):
+            embeddings = semantic_search.encode_catalog(descriptions, progress, mode,
+                                                        dict(parallel_options or {}, build_dir=build_dir))
+        # Cache the raw embeddings before they are normalized in place for serving
+        semantic_search.save_embeddings_cache(self.embeddings_cache, embeddings, descriptions, df)
+        log.info("Embeddings of catalog %s saved to %s", self.key, self.embeddings_cache)
+        if mode == 'parallel' or (mode is None and semantic_search.BUILD_MODE == 'parallel'):
+            from parallel_embeddings import clear_build
+            clear_build(build_dir)
+        return self._publish_embeddings(df, embeddings)
+
+    def _load_or_build_embeddings(self, df):
+        if self.embeddings is not None:
+            return self.embeddings
+        self._cache_checked = False
+        if self._load_cached_embeddings(df):
+            return self.embeddings
+        return self._build_embeddings(df)
+
+    def build_embeddings(self, mode=None, parallel_options=None):
+        """Encode the catalog now, in this thread (offline builds)
+
+        mode: 'serial' or 'parallel' (default: EMBEDDINGS_BUILD_MODE)
+        parallel_options: Extra arguments for build_embeddings_parallel
+        """
+        df = self.ensure_loaded()
+        return self._flight.do(
+            'embeddings', lambda: self._build_embeddings(df, self._report_progress, mode, parallel_options))
+
+    def _report_progress(self, done, total):
+        with self._status_lock:
+            previous = self.build_status['done']
+            self.build_status['done'] = done
+            self.build_status['total'] = total
+        # Log roughly every 10%
+        step = max(1, total // 10)
+        if done // step != previous // step or done == total:
+            log.info("Embedding build progress (%s): %d/%d", self.key, done, total)
+
+    def _run_background_build(self, df):
+        try:
+            self._flight.do('embeddings', lambda: self._build_embeddings(df, self._report_progress))
+            with self._status_lock:
+                self.build_status.update(state='ready', finished_at=time.time())
+        except Exception as e:
+            log.exception("Embedding build for catalog %s failed: %s", self.key, e)
+            with self._status_lock:
+                self.build_status.update(state='failed', finished_at=time.time(), error=str(e))
+
+    def start_embedding_build(self, force=False):
+        """Start (re)building the embeddings in a background thread.
+
+        Returns False if a build is already running (or, without force, if
+        embeddings are loaded or the last build failed less than
+        RETRY_FAILED_BUILD_AFTER seconds ago).
+        """
+        df = self.ensure_loaded()
+        with self._status_lock:
+            status = self.build_status
+            if status['state'] == 'building':
+                return False
+            if not force:
+                if self.embeddings is not None:
+                    return False
+                if (status['state'] == 'failed'
+                        and time.time() - status['finished_at'] < semantic_search.RETRY_FAILED_BUILD_AFTER):
+                    return False
+            status.update(state='building', done=0, total=len(df),
+                          started_at=time.time(), finished_at=None, error=None)
+        threading.Thread(target=self._run_background_build, args=(df,),
+                         name=f'embedding-build-{self.key}', daemon=True).start()
+        return True
+
+    def serving_mode(self):
+        """'semantic', 'stale_embeddings' or 'lexical'"""
+        if self.embeddings is not None:
+            return 'semantic'
+        if self.stale is not None:
+            return 'stale_embeddings'
+        return 'lexical'
+
+    def embedding_status(self):
+        """Embedding build progress and how text queries are served"""
+        with self._status_lock:
+            status = dict(self.build_status)
+        status['progress'] = round(status['done'] / status['total'], 4) if status['total'] else None
+        status['serving'] = self.serving_mode()
+        status['catalog'] = self.key
+        return status
+
+    def serving_embeddings(self):
+        """Embeddings to answer a query with, without blocking on a rebuild
+
+        Returns (embeddings, rows, mode); embeddings is None in lexical mode.
+        """
+        df = self.ensure_loaded()
+        embeddings = self.embeddings
+        if embeddings is not None:
+            return embeddings, df, 'semantic'
+        if not semantic_search.BACKGROUND_BUILD:
+            embeddings = self._flight.do('embeddings', lambda: self._load_or_build_embeddings(df))
+            return embeddings, df, 'semantic'
+        if self._flight.do('embeddings_cache', lambda: self._load_cached_embeddings(df)):
+            return self.embeddings, df, 'semantic'
+
+        self.start_embedding_build()
+        stale = self.stale
+        if stale is not None:
+            return stale[0], stale[1], 'stale_embeddings'
+        return None, None, 'lexical'
+
+    def text_embeddings(self):
+        """Normalized embeddings of every product, or None while they are built"""
+        embeddings, _, mode = self.serving_embeddings()
+        return embeddings if mode == 'semantic' else None
+
+    def _lexical_index(self, df):
+        """Lexical fallback index, built on first use while there are no embeddings"""
+        index = self.lexical
+        if index is None or index[0] is not df:
+            index = semantic_search.compute_lexical_index(df)
+            with self._lock:
+                self.lexical = index
+                self._remember('lexical_index', index[1:])
+        return index
+
+    # ===== Queries =====
+    def recommend(self, product_id):
+        df = self.ensure_loaded()
+        return model.similar_products(df, product_id, self.tag_features, self.neighbors)
+
+    def recommend_page(self, product_id, offset=0, limit=None):
+        """(results, total): one page of the ranking behind recommend()"""
+        df = self.ensure_loaded()
+        return model.similar_products_page(df, self.dataset_version, product_id, offset, limit,
+                                           self.tag_features, self.neighbors, self.rankings)
+
+    def recommend_hybrid(self, product_id, top_k=5, weights=None):
+        df = self.ensure_loaded()
+        embeddings = self.text_embeddings()
+        index = self.hybrid
+        if index is None or index[2] != (embeddings is not None):
+            with stage('build_hybrid_index'):
+                index = hybrid_index.compute_hybrid_index(df, self.tags, embeddings)
+            with self._lock:
+                self.hybrid = index
+                self._remember('hybrid_index', index[1])  # the tag block is self.tags
+            log.info("Hybrid index of catalog %s built: %d products, %d dense columns (text=%s)",
+                     self.key, len(df), index[1].shape[1], index[2])
+        return hybrid_index.hybrid_recommendations(df, product_id, top_k, weights, index)
+
+    def more_like_these(self, liked_ids, disliked_ids=None, top_k=5, weights=None):
+        df = self.ensure_loaded()
+        signals = [('tags', self.tags), ('flavor', self.flavors[2])]
+        embeddings = self.text_embeddings()
+        if embeddings is not None:
+            signals.append(('text', embeddings))
+        return model.more_like_these(df, liked_ids, disliked_ids, top_k, weights, signals)
+
+    def search_flavor(self, user_vector, top_k=15, weights=None):
+        df = self.ensure_loaded()
+        return flavor_search.search_by_flavor_profile(user_vector, top_k, weights, df, self.flavors)
+
+    def search_text(self, query, top_k=5):
+        """(results, mode): 'semantic', or 'stale_embeddings' / 'lexical' while the
+        embeddings are (re)built"""
+        if top_k < 1:
+            raise ValueError("top_k must be at least 1")
+        df = self.ensure_loaded()
+        embeddings, rows, mode = self.serving_embeddings()
+        if mode == 'lexical':
+            log.debug("Processing query (lexical fallback): %s", query)
+            index = self._lexical_index(df)
+            with stage('lexical_search'):
+                return semantic_search.lexical_search(query, df, top_k, index), mode
+        return semantic_search.semantic_rank(query, embeddings, rows, top_k), mode
+
+    def search_text_batch(self, queries, top_k=5):
+        """(results, mode) like search_text; results yields one list per query"""
+        if top_k < 1:
+            raise ValueError("top_k must be at least 1")
+        df = self.ensure_loaded()
+        embeddings, rows, mode = self.serving_embeddings()
+        if mode == 'lexical':
+            log.debug("Processing %d queries (lexical fallback)", len(queries))
+            index = self._lexical_index(df)
+            return (semantic_search.lexical_search(q, df, top_k, index) for q in queries), mode
+        log.debug("Processing %d queries", len(queries))
+        return semantic_search.semantic_rank_batch(queries, embeddings, rows, top_k), mode
+
+
+class CatalogRegistry:
+    """Routes requests to catalogs by key and keeps the loaded ones within budget"""
+
+    def __init__(self, engines, default_key, memory_budget_mb=0):
+        self.default_key = default_key
+        self.memory_budget = int(memory_budget_mb * MB)
+        self._engines = OrderedDict((e.key, e) for e in engines)  # least recently used first
+        self._lock = threading.Lock()
+        self._over_budget = False
+
+    def keys(self):
+        return list(self._engines)
+
+    def get(self, key):
+        engine = self._engines.get(key)
+        if engine is None:
+            raise CatalogNotFound(f"Catalog '{key}' not found")
+        return engine
+
+    @contextmanager
+    def use(self, key=None):
+        """Engine for a catalog, loaded, and protected from unloading while in use"""
+        key = key or self.default_key
+        with self._lock:
+            engine = self.get(key)
+            engine.in_use += 1
+            engine.last_used = time.monotonic()
+            self._engines.move_to_end(key)
+        try:
+            engine.ensure_loaded()
+            self._enforce_budget()
+            yield engine
+        finally:
+            with self._lock:
+                engine.in_use -= 1
+                engine.last_used = time.monotonic()
+
+    def memory_bytes(self):
+        return sum(e.memory_bytes() for e in self._engines.values() if e.loaded)
+
+    def check_sources(self):
+        """Raise model.DataSourceError naming every catalog that has no usable data source"""
+        errors = []
+        for engine in self._engines.values():
+            try:
+                engine.check_source()
+            except model.DataSourceError as e:
+                errors.append(f"{engine.key}: {e}")
+        if errors:
+            raise model.DataSourceError("Catalogs without a usable data source: " + '; '.join(errors))
+
+    def _enforce_budget(self):
+        """Unload idle catalogs, least recently used first, until the loaded ones fit"""
+        if not self.memory_budget:
+            return
+        with self._lock:
+            total = self.memory_bytes()
+            for engine in list(self._engines.values()):
+                if total <= self.memory_budget:
+                    break
+                if engine.pinned or engine.in_use or not engine.loaded:
+                    continue
+                freed = engine.memory_bytes()
+                engine.unload()
+                total -= freed
+                log.info("Unloaded idle catalog %s (%.1f MB) to stay within %.1f MB",
+                         engine.key, freed / MB, self.memory_budget / MB)
+        over_budget = total > self.memory_budget
+        if over_budget and not self._over_budget:
+            log.warning("Loaded catalogs use %.1f MB, over the %.1f MB budget (nothing idle to unload)",
+                        total / MB, self.memory_budget / MB)
+        self._over_budget = over_budget
+
+    def unload(self, key):
+        with self._lock:
+            engine = self.get(key)
+            if engine.in_use:
+                raise ValueError(f"Catalog {key} is serving requests")
+            engine.unload()
+
+    def memory_report(self, columns=False):
+        """Bytes per artifact of every loaded catalog, the shared encoder and the process"""
+        catalogs = {}
+        for engine in self._engines.values():
+            if not engine.loaded:
+                continue
+            report = engine.memory_report()
+            report['total'] = sum(report.values())
+            if columns:
+                report['frame_columns'] = {
+                    str(col): int(size)
+                    for col, size in engine.df.memory_usage(index=False, deep=True).items()
+                }
+            catalogs[engine.key] = report
+        return {
+            'lean_mode': model.MEMORY_LEAN,
+            'catalogs': catalogs,
+            'encoder': encoder_bytes(),
+            'process': process_memory(),
+        }
+
+    def status(self):
+        return {
+            'default': self.default_key,
+            'memory_bytes': self.memory_bytes(),
+            'memory_budget_bytes': self.memory_budget or None,
+            'catalogs': [e.status() for e in self._engines.values()],
+        }
+
+
+def load_catalog_config(path=None):
+    """{key: options} from the catalogs JSON file (empty if there is none)"""
+    path = path or CATALOGS_CONFIG
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def build_registry(config=None, default_key=None):
+    default_key = default_key or DEFAULT_CATALOG
+    config = load_catalog_config() if config is None else config
+    engines = [Recommender(default_key, table='products', csv_path="data/liquors.csv",
+                           embeddings_cache=semantic_search.CACHE_PATH, pinned=True)]
+    for key, options in config.items():
+        if key == default_key:
+            continue
+        engines.append(Recommender(
+            key,
+            table=options.get('table'),
+            csv_path=options.get('csv'),
+            embeddings_cache=options.get('embeddings_cache'),
+            memory_budget_mb=options.get('memory_budget_mb'),
+        ))
+    log.info("Catalogs: %s (default: %s)", ', '.join(e.key for e in engines), default_key)
+    return CatalogRegistry(engines, default_key, CATALOGS_MEMORY_BUDGET_MB)
+
+
+registry = None
+_registry_flight = SingleFlight()
+
+
+def get_registry():
+    global registry
+    if registry is None:
+        registry = _registry_flight.do('registry', lambda: registry or build_registry())
+    return registry
+
+
+def default_engine():
+    """Recommender of DEFAULT_CATALOG, behind the module-level API of model.py & co."""
+    registry = get_registry()
+    return registry.get(registry.default_key)
@@ -0,0 +1,401 @@
+# evaluate.py
+"""
+Offline recall-vs-latency evaluation of index, quantization and caching options.
+
+Every option is compared against the exact answers the service gives today:
+- similar products: find_similarities (per-request KNN fit + Gaussian rerank);
+  for the hybrid index, which excludes the product itself and other listings
+  with its name, the exact ranking (ranked_similarities) without them
+- text search: exact cosine over the full-precision embeddings
+  (semantic_rank, i.e. search_products_by_text, on the real catalog)
+
+and reports recall@k, rank overlap, latency (p50/p95 per query), the memory
+of the index it needs and its peak extra memory per query. Query embeddings
+are computed once up front; only the exact semantic_rank row includes
+encoding the query.
+
+Examples:
+    # Real catalog (database or data/liquors.csv) + two synthetic catalogs
+    python evaluate.py --synthetic 2000,10000 --markdown report.md --json report.json
+
+    # Synthetic catalogs only, text search only, top 10
+    python evaluate.py --no-real --synthetic 50000 --tasks text --top-k 10
+
+Synthetic catalogs have clustered brands, Zipf-distributed flavour tags,
+brand-correlated flavors and embeddings, and duplicate names, so that the
+rerank and name dedupe behave as on real data. Their text queries are
+perturbed product embeddings (exact cosine is the ground truth).
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import normalize
+
+import model
+import hybrid_index
+import semantic_search
+from flavor_search import top_k_indices
+from engine import nbytes
+
+SYNTHETIC_DIM = 384          # paraphrase-multilingual-MiniLM-L12-v2
+SYNTHETIC_TAGS = 60
+QUANTIZED_CHUNK_ROWS = 8192  # rows dequantized at once by the float16/int8 scans
+
+
+# ===== Metrics =====
+def recall_at_k(truth, found, k):
+    """Share of the exact top-k that the option also returns in its top-k"""
+    truth = list(truth)[:k]
+    if not truth:
+        return 1.0
+    return len(set(truth) & set(list(found)[:k])) / len(truth)
+
+
+def rank_overlap(truth, found, k):
+    """Average overlap of the top-d prefixes, d = 1..k (1.0 = same items in the same order)"""
+    truth, found = list(truth)[:k], list(found)[:k]
+    depth = max(len(truth), len(found))
+    if depth == 0:
+        return 1.0
+    return float(np.mean([len(set(truth[:d]) & set(found[:d])) / d for d in range(1, depth + 1)]))
+
+
+def run_timed(search, items):
+    """Answers of search for every item, and the latency of each call (seconds)"""
+    search(items[0])  # warm-up (lazy imports, first-touch of mapped pages)
+    answers, latencies = [], []
+    for item in items:
+        start = time.perf_counter()
+        answers.append(search(item))
+        latencies.append(time.perf_counter() - start)
+    return answers, latencies
+
+
+def peak_query_bytes(search, items, n=5):
+    """Largest extra allocation of a single call (numpy buffers included)"""
+    peak = 0
+    for item in items[:n]:
+        tracemalloc.start()
+        search(item)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return peak
+
+
+def score_option(truth, answers, latencies, k):
+    arr = np.asarray(latencies) * 1000
+    return {
+        'recall_at_k': round(float(np.mean([recall_at_k(t, a, k) for t, a in zip(truth, answers)])), 4),
+        'rank_overlap': round(float(np.mean([rank_overlap(t, a, k) for t, a in zip(truth, answers)])), 4),
+        'p50_ms': round(float(np.percentile(arr, 50)), 3),
+        'p95_ms': round(float(np.percentile(arr, 95)), 3),
+    }
+
+
+# ===== Catalogs =====
+def real_catalog():
+    """Served catalog and its raw embeddings (cached/encoded as by the service)"""
+    df = model.read_dataset()
+    embeddings = semantic_search.load_or_encode_catalog(df, semantic_search.CACHE_PATH)
+    return df, embeddings
+
+
+def synthetic_catalog(n, seed=0, dim=SYNTHETIC_DIM):
+    """(df, embeddings) of a generated catalog with n products"""
+    rng = np.random.default_rng(seed)
+    n_brands = max(2, n // 8)
+    brand = rng.zipf(1.3, n) % n_brands
+
+    tag_p = 1.0 / np.arange(1, SYNTHETIC_TAGS + 1)
+    tag_p /= tag_p.sum()
+    tags = ['|'.join(f'tag{t:02d}' for t in rng.choice(SYNTHETIC_TAGS, rng.integers(2, 13),
+                                                         replace=False, p=tag_p))
+            for _ in range(n)]
+
+    flavor_centers = rng.random((n_brands, len(model.FLAVOR_COLS)))
+    flavors = np.clip(flavor_centers[brand] + rng.normal(0, 0.12, (n, len(model.FLAVOR_COLS))), 0, 1)
+    flavors[rng.random(n) < 0.05] = np.nan  # products without flavor data
+
+    names = np.array([f'Synthetic {i}' for i in range(n)], dtype=object)
+    dup = np.flatnonzero(rng.random(n) < 0.05)
+    names[dup] = names[rng.integers(0, n, len(dup))]  # relisted products
+
+    data = pd.DataFrame({
+        'id': np.arange(1, n + 1) * 7,
+        'brand_intl_name': [f'Brand {b}' for b in brand],
+        'brand_name': [f'brand{b:05d}' for b in brand],
+        'checkin_count': (rng.pareto(1.2, n) * 20).astype(np.int64),
+        **{col: flavors[:, i] for i, col in enumerate(model.FLAVOR_COLS)},
+        'flavour_tags': tags,
+        'intl_name': names,
+        'name': names,
+        'pictures': '',
+        'score': np.round(rng.uniform(3.0, 5.0, n), 2),
+        'similar_brands': '',
+        'year_month': '2024-01',
+    })
+    data = model.clean_data(model.mark_missing_flavors(data))
+    data['_index'] = data.index
+
+    centers = rng.normal(size=(n_brands, dim))
+    embeddings = normalize(centers[brand] + rng.normal(scale=0.8, size=(n, dim))).astype(np.float32)
+    return data, embeddings
+
+
+def sample_products(df, n, rng):
+    """Positions of products that have KNN features (the others get random samples)"""
+    usable = [pos for pos in range(len(df)) if model.entry_variables(df, pos)]
+    return sorted(rng.choice(usable, min(n, len(usable)), replace=False).tolist())
+
+
+# ===== Similar products =====
+def evaluate_similar(name, df, embeddings, positions, k, max_table_products):
+    """Options for /recommend/{id} against the exact find_similarities"""
+    rows = []
+    ids = df['id'].to_numpy()
+    tag_features = model.compute_tag_matrix(df)
+
+    def exact(pos):
+        return [r['id'] for r in model.find_similarities(df, pos, tags=tag_features)][:k]
+
+    truth, latencies = run_timed(exact, positions)
+    rows.append(dict(config='knn_exact', index_bytes=nbytes(tag_features),
+                     peak_query_bytes=peak_query_bytes(exact, positions), build_seconds=0.0,
+                     **score_option(truth, truth, latencies, k)))
+
+    if len(df) <= max_table_products:
+        start = time.perf_counter()
+        table = model.compute_neighbor_table(df, tag_features)
+        build = time.perf_counter() - start
+
+        def cached(pos):
+            return [r['id'] for r in model.find_similarities(df, pos, tags=tag_features,
+                                                             neighbors=table)][:k]
+
+        answers, latencies = run_timed(cached, positions)
+        rows.append(dict(config='neighbor_table', index_bytes=nbytes(tag_features) + table.nbytes,
+                         peak_query_bytes=peak_query_bytes(cached, positions),
+                         build_seconds=round(build, 2), **score_option(truth, answers, latencies, k)))
+
+    # The hybrid index never returns the product itself or another listing with its
+    # name, find_similarities does: its ground truth is the exact ranking without them
+    def exact_without_seed(pos):
+        name = df['name'].iat[pos]
+        ranking = model.ranked_similarities(df, pos, tags=tag_features)
+        return [int(ids[int(s[10])]) for s in ranking if s[8] != name][:k]
+
+    hybrid_truth = [exact_without_seed(pos) for pos in positions]
+    for label, emb in (('hybrid', normalize(embeddings) if embeddings is not None else None),
+                       ('hybrid_no_text', None)):
+        start = time.perf_counter()
+        index = hybrid_index.compute_hybrid_index(df, normalize(tag_features[0]), emb)
+        build = time.perf_counter() - start
+
+        def fused(pos):
+            return [r['id'] for r in hybrid_index.hybrid_recommendations(
+                df, int(ids[pos]), k, index=index)]
+
+        answers, latencies = run_timed(fused, positions)
+        rows.append(dict(config=label, index_bytes=nbytes(index[:2]),
+                         peak_query_bytes=peak_query_bytes(fused, positions),
+                         build_seconds=round(build, 2),
+                         **score_option(hybrid_truth, answers, latencies, k)))
+        if embeddings is None:
+            break
+
+    return [dict(catalog=name, task='similar', products=len(df), **row) for row in rows]
+
+
+# ===== Text search =====
+def quantize_int8(matrix):
+    """Symmetric per-dimension int8 codes and scales"""
+    scale = np.abs(matrix).max(axis=0) / 127.0
+    scale[scale == 0] = 1.0
+    codes = np.round(matrix / scale).astype(np.int8)
+    return codes, scale.astype(np.float32)
+
+
+def chunked_scores(stored, query, scale=None):
+    """stored @ query for a reduced-precision matrix, dequantizing a chunk of rows at a time"""
+    if scale is not None:
+        query = query * scale
+    scores = np.empty(len(stored), dtype=np.float32)
+    for start in range(0, len(stored), QUANTIZED_CHUNK_ROWS):
+        chunk = stored[start:start + QUANTIZED_CHUNK_ROWS].astype(np.float32)
+        scores[start:start + QUANTIZED_CHUNK_ROWS] = chunk @ query
+    return scores
+
+
+def evaluate_text(name, df, embeddings, query_vectors, k, queries=None):
+    """Options for /recommend-by-text against exact cosine
+
+    queries: the query strings (real catalog); with them the ground truth is
+    semantic_rank itself and the lexical fallback is evaluated too.
+    """
+    rows = []
+    products = semantic_search._normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    positions = pd.Index(df['id'])
+    items = list(range(len(query_vectors)))
+
+    if queries is not None:
+        def exact(i):
+            results = semantic_search.semantic_rank(queries[i], products, df, k)
+            return positions.get_indexer([r['id'] for r in results]).tolist()
+        raw_bytes = products.nbytes
+    else:
+        exact_products = products.astype(np.float64)
+
+        def exact(i):
+            return top_k_indices(exact_products @ query_vectors[i].astype(np.float64), k).tolist()
+        raw_bytes = exact_products.nbytes
+
+    truth, latencies = run_timed(exact, items)
+    rows.append(dict(config='exact', index_bytes=raw_bytes, build_seconds=0.0,
+                     peak_query_bytes=peak_query_bytes(exact, items),
+                     **score_option(truth, truth, latencies, k)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'embeddings.npy')
+        np.save(path, products)
+        mapped = np.load(path, mmap_mode='r')
+        codes, scale = quantize_int8(products)
+        options = [
+            ('float32', products.nbytes, lambda i: products @ query_vectors[i]),
+            ('float32_mmap', 0, lambda i: mapped @ query_vectors[i]),
+            ('float16', products.nbytes // 2,
+             lambda i, half=products.astype(np.float16): chunked_scores(half, query_vectors[i])),
+            ('int8', codes.nbytes + scale.nbytes, lambda i: chunked_scores(codes, query_vectors[i], scale)),
+        ]
+        for label, size, scores in options:
+            def search(i, scores=scores):
+                return top_k_indices(scores(i), k).tolist()
+
+            answers, latencies = run_timed(search, items)
+            rows.append(dict(config=label, index_bytes=size, build_seconds=0.0,
+                             peak_query_bytes=peak_query_bytes(search, items),
+                             **score_option(truth, answers, latencies, k)))
+        del mapped
+
+    # Batched scoring (/recommend-by-text/batch): one pass over all queries, per-query latency amortized
+    def batch():
+        answers = []
+        for chunk in range(0, len(query_vectors), semantic_search.SCORE_CHUNK_ROWS):
+            scores = query_vectors[chunk:chunk + semantic_search.SCORE_CHUNK_ROWS] @ products.T
+            answers.extend(semantic_search.top_k_rows(scores, k).tolist())
+        return answers
+
+    start = time.perf_counter()
+    answers = batch()
+    per_query = (time.perf_counter() - start) / max(len(items), 1)
+    tracemalloc.start()
+    batch()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rows.append(dict(config='float32_batch', index_bytes=products.nbytes, build_seconds=0.0,
+                     peak_query_bytes=peak, **score_option(truth, answers, [per_query] * len(items), k)))
+
+    if queries is not None:
+        index = semantic_search.compute_lexical_index(df)
+
+        def lexical(i):
+            results = semantic_search.lexical_search(queries[i], df, k, index)
+            return positions.get_indexer([r['id'] for r in results]).tolist()
+
+        answers, latencies = run_timed(lexical, items)
+        rows.append(dict(config='lexical', index_bytes=nbytes(index[1:]), build_seconds=0.0,
+                         peak_query_bytes=peak_query_bytes(lexical, items),
+                         **score_option(truth, answers, latencies, k)))
+
+    return [dict(catalog=name, task='text', products=len(df), **row) for row in rows]
+
+
+# ===== Report =====
+COLUMNS = [
+    ('catalog', 'catalog'), ('task', 'task'), ('config', 'config'), ('products', 'products'),
+    ('recall_at_k', 'recall@k'), ('rank_overlap', 'rank overlap'), ('p50_ms', 'p50 ms'),
+    ('p95_ms', 'p95 ms'), ('index_bytes', 'index MB'), ('peak_query_bytes', 'peak/query MB'),
+    ('build_seconds', 'build s'),
+]
+
+
+def render_markdown(report):
+    def cell(key, value):
+        if key.endswith('_bytes'):
+            return f'{value / 2**20:.2f}'
+        return str(value)
+
+    lines = [
+        f"Recall vs latency (top_k={report['top_k']}, {report['products_sampled']} products, "
+        f"{report['queries']} queries per catalog)",
+        '',
+        '| ' + ' | '.join(title for _, title in COLUMNS) + ' |',
+        '|' + '---|' * len(COLUMNS),
+    ]
+    for row in report['rows']:
+        lines.append('| ' + ' | '.join(cell(key, row[key]) for key, _ in COLUMNS) + ' |')
+    return '\n'.join(lines) + '\n'
+
+
+def evaluate_catalog(name, df, embeddings, query_vectors, args, rng, queries=None):
+    rows = []
+    if 'similar' in args.tasks:
+        positions = sample_products(df, args.products, rng)
+        rows += evaluate_similar(name, df, embeddings, positions, args.top_k, args.max_table_products)
+    if 'text' in args.tasks and embeddings is not None:
+        rows += evaluate_text(name, df, embeddings, query_vectors, args.top_k, queries)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of index, quantization and caching options")
+    parser.add_argument('--no-real', action='store_true', help="Skip the served catalog")
+    parser.add_argument('--synthetic', default='', help="Synthetic catalog sizes, e.g. 2000,10000")
+    parser.add_argument('--tasks', default='similar,text', help="similar and/or text")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--products', type=int, default=200, help="Seed products sampled per catalog")
+    parser.add_argument('--queries', type=int, default=200, help="Text queries per catalog")
+    parser.add_argument('--max-table-products', type=int, default=5000,
+                        help="Skip the neighbor table (one KNN fit per product) above this size")
+    parser.add_argument('--dim', type=int, default=SYNTHETIC_DIM, help="Synthetic embedding size")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='json_path', help="Write the report to this file")
+    parser.add_argument('--markdown', help="Write the comparison table to this file")
+    args = parser.parse_args()
+    args.tasks = {t.strip() for t in args.tasks.split(',') if t.strip()}
+
+    rng = np.random.default_rng(args.seed)
+    rows = []
+    if not args.no_real:
+        from load_test import build_query_pool
+        df, embeddings = real_catalog()
+        queries = build_query_pool(args.queries, args.seed)
+        query_vectors = semantic_search.encode_queries(queries)
+        rows += evaluate_catalog('real', df, embeddings, query_vectors, args, rng, queries)
+
+    for size in (int(s) for s in args.synthetic.split(',') if s.strip()):
+        df, embeddings = synthetic_catalog(size, args.seed, args.dim)
+        picks = rng.integers(0, size, args.queries)
+        query_vectors = semantic_search._normalize_rows(
+            embeddings[picks] + rng.normal(scale=0.05, size=(args.queries, args.dim)).astype(np.float32))
+        rows += evaluate_catalog(f'synthetic-{size}', df, embeddings, query_vectors, args, rng)
+
+    report = {'top_k': args.top_k, 'products_sampled': args.products, 'queries': args.queries,
+              'rows': rows}
+    table = render_markdown(report)
+    print(table)
+    if args.markdown:
+        with open(args.markdown, 'w', encoding='utf-8') as f:
+            f.write(table)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
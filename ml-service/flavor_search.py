@@ -0,0 +1,160 @@
+# flavor_search.py
+import numpy as np
+import pandas as pd
+from model import FLAVOR_COLS
+from metrics import stage
+
+# Same defaults as the Java FlavorSearchService:
+# missing user values -> 0.5, missing product values -> 0.0
+USER_FLAVOR_DEFAULT = 0.5
+PRODUCT_FLAVOR_DEFAULT = 0.0
+
+def compute_flavor_matrix(df):
+    """Raw, squared and row-normalized N x 6 float32 flavor matrices"""
+    matrix = df[FLAVOR_COLS].to_numpy(dtype=np.float32, copy=True)
+
+    # load_data() fills null flavors with the median; restore the Java default
+    if '_flavor_missing' in df.columns:
+        missing = df['_flavor_missing'].to_numpy()
+        for bit in range(len(FLAVOR_COLS)):
+            matrix[(missing >> bit) & 1 == 1, bit] = PRODUCT_FLAVOR_DEFAULT
+    matrix = np.nan_to_num(matrix, nan=PRODUCT_FLAVOR_DEFAULT)
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix_norm = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+    return matrix, matrix * matrix, matrix_norm
+
+def flavor_scores(user_vector, weights=None, matrices=None):
+    """
+    Cosine similarity between a user flavor vector and every product
+
+    Args:
+        user_vector: 6 flavor values, None entries default to 0.5
+        weights: Optional 6 non-negative weights for a weighted cosine
+        matrices: (raw, squared, normalized) from compute_flavor_matrix
+                  (default: the default catalog's)
+
+    Returns:
+        float32 array with one similarity per product
+    """
+    if matrices is None:
+        from engine import default_engine
+        engine = default_engine()
+        engine.ensure_loaded()
+        matrices = engine.flavors
+    raw, raw_sq, normalized = matrices
+
+    q = np.array(
+        [USER_FLAVOR_DEFAULT if v is None else v for v in user_vector],
+        dtype=np.float32
+    )
+
+    if weights is None:
+        q_norm = np.linalg.norm(q)
+        if q_norm == 0:
+            return np.zeros(len(normalized), dtype=np.float32)
+        return normalized @ (q / q_norm)
+
+    # Weighted cosine: sum(w*a*b) / (sqrt(sum(w*a^2)) * sqrt(sum(w*b^2)))
+    w = np.asarray(weights, dtype=np.float32)
+    q_norm = np.sqrt(np.dot(w, q * q))
+    if q_norm == 0:
+        return np.zeros(len(raw), dtype=np.float32)
+    dots = raw @ (w * q)
+    product_norms = np.sqrt(raw_sq @ w)
+    return np.divide(dots, product_norms * q_norm,
+                     out=np.zeros_like(dots), where=product_norms > 0)
+
+def top_k_indices(scores, top_k):
+    """Indices of the top_k highest scores, highest first"""
+    n = len(scores)
+    top_k = max(0, min(top_k, n))
+    if top_k == 0:
+        return np.array([], dtype=np.int64)
+    if top_k < n:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(n)
+    # Stable sort keeps catalog order for equal scores, like the Java service
+    order = np.argsort(-scores[candidates], kind='stable')
+    return candidates[order]
+
+def search_by_flavor_profile(user_vector, top_k=15, weights=None, df=None, matrices=None):
+    """
+    Search products by flavor profile using cosine similarity
+
+    Args:
+        user_vector: List of 6 flavor values (f1..f6), None -> 0.5
+        top_k: Number of products to return (default: 15, at least 1)
+        weights: Optional per-dimension weights (weighted cosine)
+        df, matrices: A catalog and its compute_flavor_matrix output
+                      (default: the default catalog)
+
+    Returns:
+        List of products with similarity information
+    """
+    if matrices is None:
+        from engine import default_engine
+        return default_engine().search_flavor(user_vector, top_k, weights)
+    if len(user_vector) != len(FLAVOR_COLS):
+        raise ValueError(f"Expected {len(FLAVOR_COLS)} flavor values, got {len(user_vector)}")
+    if top_k < 1:
+        raise ValueError("top_k must be at least 1")
+    if weights is not None:
+        if len(weights) != len(FLAVOR_COLS):
+            raise ValueError(f"Expected {len(FLAVOR_COLS)} weights, got {len(weights)}")
+        if any(w < 0 for w in weights):
+            raise ValueError("Weights must be non-negative")
+
+    raw = matrices[0]
+
+    with stage('flavor_scores'):
+        scores = flavor_scores(user_vector, weights, matrices)
+        top_results = top_k_indices(scores, top_k)
+
+    results = []
+    for rank, idx in enumerate(top_results):
+        row = df.iloc[idx]
+        similarity = float(scores[idx])
+
+        def safe_get(key, default=None):
+            val = row.get(key, default)
+            if val is None or pd.isnull(val):
+                return default
+            if isinstance(val, np.integer):
+                return int(val)
+            if isinstance(val, np.floating):
+                return float(val)
+            return val
+
+        def safe_split(key):
+            val = safe_get(key, '')
+            if val and isinstance(val, str):
+                return [x.strip() for x in val.split('|') if x.strip()]
+            return []
+
+        missing = int(safe_get('_flavor_missing', 0))
+
+        result = {
+            'rank': int(rank + 1),
+            'similarity': round(similarity, 4),
+            'similarity_percent': f"{similarity * 100:.1f}",
+            'id': int(safe_get('id', 0)) if safe_get('id') is not None else None,
+            'brand': safe_get('brand_name'),
+            'brand_intl_name': safe_get('brand_intl_name'),
+            'name': safe_get('name'),
+            'intl_name': safe_get('intl_name'),
+            'score': float(round(float(safe_get('score', 0)), 2)) if safe_get('score') is not None else None,
+            'checkin_count': int(safe_get('checkin_count', 0)) if safe_get('checkin_count') is not None else None,
+            'flavors': {
+                col: None if (missing >> i) & 1 else float(round(float(raw[idx, i]), 3))
+                for i, col in enumerate(FLAVOR_COLS)
+            },
+            'flavour_tags': safe_split('flavour_tags'),
+            'pictures': safe_split('pictures'),
+            'similar_brands': safe_split('similar_brands'),
+            'year_month': safe_get('year_month'),
+        }
+        results.append(result)
+
+    return results
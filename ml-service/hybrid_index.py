@@ -0,0 +1,131 @@
+# hybrid_index.py
+"""
+Fused similarity index: tag overlap + flavor distance + embedding cosine.
+
+Every product gets one combined row. A query product is turned into a single
+query vector (with the signal weights folded in), and the similarity to the
+whole catalog is one product with the index:
+
+    score = w_tags   * cos(tags_a, tags_b)
+          + w_flavor * (1 - ||flavor_a - flavor_b||^2 / 6)
+          + w_text   * cos(embedding_a, embedding_b)
+          (divided by the sum of the weights that are available)
+
+The flavor term is an exact squared distance, written as a dot product by
+storing [f, ||f||^2, 1] per product and querying with
+[2f_a, -1, -||f_a||^2] / 6 (+ 1 on the constant column). The tag block stays
+sparse, the flavor and embedding blocks are one dense float32 matrix.
+"""
+import os
+
+import numpy as np
+
+from sklearn.preprocessing import normalize
+
+from model import (compute_tag_matrix, ids_to_positions, selection_entry,
+                   add_to_selection, build_selection_results, FLAVOR_COLS)
+from metrics import stage
+from logger import get_logger
+
+log = get_logger('hybrid_index')
+
+def _parse_weights(spec):
+    """'tags=1,flavor=1,text=1' -> dict"""
+    weights = {}
+    for part in spec.split(','):
+        if '=' in part:
+            name, value = part.split('=', 1)
+            weights[name.strip()] = float(value)
+    return weights
+
+HYBRID_WEIGHTS = {'tags': 1.0, 'flavor': 1.0, 'text': 1.0}
+HYBRID_WEIGHTS.update(_parse_weights(os.getenv('HYBRID_WEIGHTS', '')))
+
+# Max squared distance between two flavor vectors in [0, 1]^6
+FLAVOR_MAX_SQ_DISTANCE = float(len(FLAVOR_COLS))
+
+def compute_hybrid_index(df, tags, embeddings=None):
+    """Combined per-product representation: (tag_block, dense_block, has_text)
+
+    tags: row-normalized tag matrix of df; embeddings: normalized, or None
+    """
+    flavors = np.nan_to_num(df[FLAVOR_COLS].to_numpy(dtype=np.float32, copy=True))
+    parts = [
+        flavors,
+        np.einsum('ij,ij->i', flavors, flavors)[:, None],
+        np.ones((len(df), 1), dtype=np.float32),
+    ]
+    if embeddings is not None:
+        parts.append(np.asarray(embeddings, dtype=np.float32))
+
+    dense = np.ascontiguousarray(np.hstack(parts), dtype=np.float32)
+    return tags, dense, embeddings is not None
+
+def query_vector(dense, position, weights):
+    """Dense half of the query for one product, signal weights folded in"""
+    n_flavor = len(FLAVOR_COLS)
+    row = dense[position]
+    f = row[:n_flavor]
+    w_flavor = weights['flavor'] / FLAVOR_MAX_SQ_DISTANCE
+    q = np.zeros(dense.shape[1], dtype=np.float32)
+    q[:n_flavor] = 2.0 * w_flavor * f
+    q[n_flavor] = -w_flavor
+    q[n_flavor + 1] = weights['flavor'] - w_flavor * float(f @ f)
+    q[n_flavor + 2:] = weights['text'] * row[n_flavor + 2:]
+    return q
+
+def hybrid_scores(df, position, weights=None, index=None):
+    """Fused similarity of one product to every product (single index query)
+
+    index: compute_hybrid_index output (default: tags and flavor of df, computed on the spot)
+    """
+    weights = dict(HYBRID_WEIGHTS, **(weights or {}))
+    if index is None:
+        index = compute_hybrid_index(df, normalize(compute_tag_matrix(df)[0]))
+    tags, dense, text = index
+    if not text:
+        weights['text'] = 0.0
+    total = weights['tags'] + weights['flavor'] + weights['text']
+    if total <= 0:
+        raise ValueError("At least one hybrid weight must be positive")
+
+    scores = dense @ query_vector(dense, position, weights)
+    if weights['tags']:
+        scores += weights['tags'] * np.asarray(tags @ tags[position].T.toarray()).ravel()
+    return scores / total
+
+def recommend_hybrid(product_id, top_k=5, weights=None):
+    """
+    Top-k similar products for a product ID from the fused index
+
+    Args:
+        product_id: The actual product ID from database
+        top_k: Number of products to return
+        weights: Optional override of HYBRID_WEIGHTS ({'tags', 'flavor', 'text'})
+
+    Returns:
+        List of recommended products, same records as recommend_by_id
+    """
+    from engine import default_engine
+    return default_engine().recommend_hybrid(product_id, top_k, weights)
+
+def hybrid_recommendations(df_local, product_id, top_k=5, weights=None, index=None):
+    """recommend_hybrid over any catalog DataFrame and its index"""
+    position = int(ids_to_positions(df_local, [product_id])[0])
+
+    with stage('hybrid_query'):
+        scores = hybrid_scores(df_local, position, weights, index)
+        # The product itself and other listings with the same name are not recommendations
+        scores[(df_local['name'] == df_local['name'].iat[position]).to_numpy()] = -np.inf
+
+        # Some extra candidates so that dropping duplicate names still leaves top_k
+        n_valid = int(np.isfinite(scores).sum())
+        n_candidates = min(4 * top_k, n_valid)
+        if n_candidates <= 0:
+            return []
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        entries = [selection_entry(df_local, i) for i in candidates]
+        selection = add_to_selection([], entries, len(entries), limit=top_k)
+
+    return build_selection_results(df_local, selection)
@@ -0,0 +1,313 @@
+# load_test.py
+"""
+Load generator for the ML service.
+
+Drives the FastAPI app either in-process (ASGI transport, no server needed)
+or against a running uvicorn, with a configurable mix of /recommend/{id},
+/recommend-by-text and /search/flavor traffic.
+
+Examples:
+    # In-process, closed loop, 8 concurrent users for 30s
+    python load_test.py --mode closed --concurrency 8 --duration 30
+
+    # Against a local uvicorn, open loop at 40 req/s, 90% /recommend
+    python load_test.py --url http://127.0.0.1:8000 --mode open --rate 40 \\
+        --mix recommend=0.9,text=0.1
+
+    # Find the saturation point: closed-loop sweep over concurrency levels
+    python load_test.py --sweep 1,2,4,8,16,32 --duration 15
+
+Product ids are drawn from a Zipf distribution over the catalog ranked by
+checkin_count (popular products get most of the traffic), and text queries
+from a Zipf-weighted pool (a few head queries, a long tail).
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+import httpx
+
+DEFAULT_MIX = {'recommend': 0.7, 'text': 0.25, 'flavor': 0.05}
+
+HEAD_QUERIES = [
+    "Tôi muốn rượu vang đỏ ngọt ngào",
+    "Rượu sake nhẹ nhàng, dễ uống",
+    "I want a sweet red wine",
+    "Strong whisky with smoky flavor",
+    "dry sake for sushi",
+    "fruity sake",
+    "甘口 フルーティ",
+    "辛口 スッキリ",
+]
+QUERY_STYLES = ["sweet", "dry", "fruity", "light", "rich", "smooth", "crisp", "floral", "umami", "aged"]
+QUERY_TEMPLATES = [
+    "{a} and {b} sake",
+    "I want something {a} with {b} notes",
+    "{a} sake that is not too {b}",
+    "recommend a {a} {b} drink for dinner",
+]
+
+
+# ===== Traffic model =====
+def zipf_weights(n, s):
+    """Normalized Zipf weights for ranks 1..n"""
+    ranks = np.arange(1, n + 1, dtype=np.float64)
+    weights = ranks ** -s
+    return weights / weights.sum()
+
+
+def build_query_pool(size, seed):
+    """Head queries first, then generated long-tail queries"""
+    rng = random.Random(seed)
+    pool = list(HEAD_QUERIES)
+    while len(pool) < size:
+        a, b = rng.sample(QUERY_STYLES, 2)
+        pool.append(rng.choice(QUERY_TEMPLATES).format(a=a, b=b))
+    return pool[:size]
+
+
+def load_product_ids():
+    """Catalog ids ranked by popularity (checkin_count, highest first)"""
+    from model import load_data
+    df = load_data()
+    ranked = df.sort_values('checkin_count', ascending=False)
+    return ranked['id'].astype(int).tolist()
+
+
+class TrafficGenerator:
+    def __init__(self, ids, mix, id_dist='zipf', id_skew=1.1,
+                 query_pool_size=500, query_skew=1.0, top_k=5, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.ids = np.asarray(ids)
+        self.id_p = zipf_weights(len(ids), id_skew) if id_dist == 'zipf' else None
+        self.queries = build_query_pool(query_pool_size, seed)
+        self.query_p = zipf_weights(len(self.queries), query_skew)
+        self.kinds = list(mix)
+        total = sum(mix.values())
+        self.kind_p = [mix[k] / total for k in self.kinds]
+        self.top_k = top_k
+
+    def next_request(self, kind=None):
+        """Return (kind, method, path, json_body), kind is drawn from the mix if not given"""
+        if kind is None:
+            kind = self.kinds[self.rng.choice(len(self.kinds), p=self.kind_p)]
+        if kind == 'recommend':
+            product_id = int(self.rng.choice(self.ids, p=self.id_p))
+            return kind, 'GET', f'/recommend/{product_id}', None
+        if kind == 'text':
+            query = self.queries[self.rng.choice(len(self.queries), p=self.query_p)]
+            return kind, 'POST', '/recommend-by-text', {'query': query, 'top_k': self.top_k}
+        flavors = {f'f{i}': round(float(v), 2) for i, v in enumerate(self.rng.random(6), 1)}
+        return kind, 'POST', '/search/flavor', {**flavors, 'top_k': self.top_k}
+
+
+# ===== Result collection =====
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.errors = Counter()
+        self.dropped = 0
+        self.recording = False
+
+    def record(self, kind, status, latency):
+        if not self.recording:
+            return
+        self.latencies[kind].append(latency)
+        self.statuses[kind][status] += 1
+        if status == 'error' or status >= 500:
+            self.errors[kind] += 1
+
+    def drop(self):
+        """An open-loop arrival that was never sent (client-side cap reached)"""
+        if self.recording:
+            self.dropped += 1
+
+    def report(self, elapsed):
+        def summarize(latencies, statuses, errors):
+            count = sum(statuses.values())
+            arr = np.asarray(latencies) * 1000
+            return {
+                'requests': count,
+                'throughput_rps': round(count / elapsed, 2) if elapsed else 0.0,
+                'error_rate': round(errors / count, 4) if count else 0.0,
+                'p50_ms': round(float(np.percentile(arr, 50)), 2) if count else None,
+                'p95_ms': round(float(np.percentile(arr, 95)), 2) if count else None,
+                'p99_ms': round(float(np.percentile(arr, 99)), 2) if count else None,
+                'max_ms': round(float(arr.max()), 2) if count else None,
+                'statuses': {str(k): v for k, v in statuses.items()},
+            }
+
+        report = {'elapsed_seconds': round(elapsed, 2), 'endpoints': {}}
+        all_latencies, all_statuses = [], Counter()
+        for kind in sorted(self.latencies):
+            report['endpoints'][kind] = summarize(
+                self.latencies[kind], self.statuses[kind], self.errors[kind])
+            all_latencies.extend(self.latencies[kind])
+            all_statuses.update(self.statuses[kind])
+        report['total'] = summarize(all_latencies, all_statuses, sum(self.errors.values()))
+        # Dropped arrivals have no latency and were not served: kept out of the
+        # samples and the throughput above, reported on their own
+        arrivals = report['total']['requests'] + self.dropped
+        report['dropped'] = self.dropped
+        report['drop_rate'] = round(self.dropped / arrivals, 4) if arrivals else 0.0
+        return report
+
+
+async def send(client, recorder, traffic, scheduled_at=None):
+    kind, method, path, body = traffic.next_request()
+    # Open loop measures from the scheduled send time (avoids coordinated omission)
+    start = scheduled_at if scheduled_at is not None else time.perf_counter()
+    try:
+        response = await client.request(method, path, json=body)
+        status = response.status_code
+    except httpx.HTTPError:
+        status = 'error'
+    recorder.record(kind, status, time.perf_counter() - start)
+
+
+# ===== Load modes =====
+async def run_closed_loop(client, recorder, traffic, concurrency, stop_at):
+    """N users, each sends its next request as soon as the previous one returns"""
+    async def user():
+        while time.perf_counter() < stop_at:
+            await send(client, recorder, traffic)
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+
+
+async def run_open_loop(client, recorder, traffic, rate, stop_at, max_inflight):
+    """Poisson arrivals at `rate` req/s regardless of response times"""
+    rng = np.random.default_rng()
+    inflight = set()
+    next_at = time.perf_counter()
+    while next_at < stop_at:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(inflight) >= max_inflight:
+            # Client-side saturation: the arrival is dropped, not sent
+            recorder.drop()
+        else:
+            task = asyncio.create_task(send(client, recorder, traffic, scheduled_at=next_at))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+        next_at += rng.exponential(1.0 / rate)
+    if inflight:
+        await asyncio.gather(*inflight)
+
+
+def make_client(url, timeout):
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits)
+    from app import app
+    transport = httpx.ASGITransport(app=app)
+    return httpx.AsyncClient(transport=transport, base_url='http://loadtest', timeout=timeout)
+
+
+async def run_load(args, traffic, concurrency=None):
+    recorder = Recorder()
+    async with make_client(args.url, args.timeout) as client:
+        # Warm-up: trigger lazy loads (data, model, embeddings) before measuring
+        for kind in traffic.kinds:
+            _, method, path, body = traffic.next_request(kind)
+            await client.request(method, path, json=body)
+
+        if args.warmup > 0:
+            warm_until = time.perf_counter() + args.warmup
+            if args.mode == 'open':
+                await run_open_loop(client, recorder, traffic, args.rate, warm_until, args.max_inflight)
+            else:
+                await run_closed_loop(client, recorder, traffic, concurrency or args.concurrency, warm_until)
+
+        recorder.recording = True
+        start = time.perf_counter()
+        stop_at = start + args.duration
+        if args.mode == 'open':
+            await run_open_loop(client, recorder, traffic, args.rate, stop_at, args.max_inflight)
+        else:
+            await run_closed_loop(client, recorder, traffic, concurrency or args.concurrency, stop_at)
+        elapsed = time.perf_counter() - start
+    return recorder.report(elapsed)
+
+
+def print_report(report, title):
+    print(f"\n{'=' * 90}\n{title}\n{'=' * 90}")
+    print(f"{'endpoint':<12}{'requests':>10}{'rps':>10}{'err%':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = list(report['endpoints'].items()) + [('TOTAL', report['total'])]
+    for name, r in rows:
+        fmt = lambda v: f"{v:>10.1f}" if v is not None else f"{'-':>10}"
+        print(f"{name:<12}{r['requests']:>10}{r['throughput_rps']:>10.1f}{r['error_rate'] * 100:>8.2f}"
+              f"{fmt(r['p50_ms'])}{fmt(r['p95_ms'])}{fmt(r['p99_ms'])}{fmt(r['max_ms'])}")
+    if report['dropped']:
+        print(f"dropped {report['dropped']} arrivals at the client ({report['drop_rate'] * 100:.2f}% "
+              f"of arrivals, not counted above)")
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown endpoint '{kind}' (use {', '.join(DEFAULT_MIX)})")
+        mix[kind] = float(weight)
+    return {k: w for k, w in mix.items() if w > 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the ML recommendation service")
+    parser.add_argument('--url', help="Base URL of a running server (default: in-process ASGI)")
+    parser.add_argument('--mode', choices=['closed', 'open'], default='closed')
+    parser.add_argument('--concurrency', type=int, default=8, help="Closed loop: concurrent users")
+    parser.add_argument('--rate', type=float, default=20.0, help="Open loop: arrivals per second")
+    parser.add_argument('--max-inflight', type=int, default=1000, help="Open loop: client-side cap")
+    parser.add_argument('--sweep', help="Closed loop concurrency levels, e.g. 1,2,4,8,16")
+    parser.add_argument('--duration', type=float, default=30.0, help="Measured seconds per run")
+    parser.add_argument('--warmup', type=float, default=3.0, help="Unmeasured seconds before each run")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help="e.g. recommend=0.7,text=0.3")
+    parser.add_argument('--id-dist', choices=['zipf', 'uniform'], default='zipf')
+    parser.add_argument('--id-skew', type=float, default=1.1, help="Zipf exponent for product ids")
+    parser.add_argument('--query-pool', type=int, default=500, help="Distinct text queries")
+    parser.add_argument('--query-skew', type=float, default=1.0, help="Zipf exponent for queries")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='json_path', help="Also write the report(s) to this file")
+    args = parser.parse_args()
+
+    traffic = TrafficGenerator(load_product_ids(), args.mix, args.id_dist, args.id_skew,
+                               args.query_pool, args.query_skew, args.top_k, args.seed)
+    target = args.url or 'in-process ASGI'
+
+    reports = []
+    if args.sweep:
+        args.mode = 'closed'
+        for level in [int(x) for x in args.sweep.split(',')]:
+            report = asyncio.run(run_load(args, traffic, concurrency=level))
+            report['concurrency'] = level
+            reports.append(report)
+            print_report(report, f"closed loop, concurrency={level} ({target})")
+        print(f"\n{'concurrency':>12}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}{'err%':>8}")
+        for r in reports:
+            t = r['total']
+            print(f"{r['concurrency']:>12}{t['throughput_rps']:>10.1f}{t['p50_ms'] or 0:>10.1f}"
+                  f"{t['p99_ms'] or 0:>10.1f}{t['error_rate'] * 100:>8.2f}")
+    else:
+        report = asyncio.run(run_load(args, traffic))
+        desc = (f"open loop, {args.rate:g} req/s" if args.mode == 'open'
+                else f"closed loop, concurrency={args.concurrency}")
+        print_report(report, f"{desc} ({target})")
+        reports.append(report)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(reports if args.sweep else reports[0], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# logger.py
+"""
+Structured, non-blocking logging for the ML service.
+
+Records are put on an in-memory queue and written to stdout by a background
+QueueListener thread, so request threads never block on terminal I/O.
+
+Environment:
+    LOG_LEVEL        DEBUG / INFO / WARNING ... (default INFO)
+    LOG_FORMAT       json (default) or text
+    LOG_SAMPLE_RATE  fraction of requests whose DEBUG lines are kept (default 0.01)
+    LOG_QUEUE_SIZE   max buffered records, extra records are dropped (default 10000)
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+# Per-request context, set by the app middleware (copied into threadpool workers)
+request_id_var = contextvars.ContextVar('request_id', default=None)
+sampled_var = contextvars.ContextVar('log_sampled', default=True)
+
+# Standard LogRecord attributes, everything else passed via `extra=` is a field
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and key != 'request_id':
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+
+    def format(self, record):
+        if not hasattr(record, 'request_id') or record.request_id is None:
+            record.request_id = '-'
+        return super().format(record)
+
+
+class ContextFilter(logging.Filter):
+    """Attach the request id and drop DEBUG lines of unsampled requests"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        if record.levelno <= logging.DEBUG and not sampled_var.get():
+            return False
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks and defers formatting to the listener"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+    def prepare(self, record):
+        # Resolve %-args now (they may be mutated later) but leave exc_info
+        # so the traceback is formatted on the listener thread.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener = None
+
+
+def setup_logging():
+    """Install the queue handler on the `ml` logger (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger('ml')
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the background writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name):
+    """Logger under the `ml` namespace, e.g. get_logger('model') -> ml.model"""
+    setup_logging()
+    return logging.getLogger(f'ml.{name}')
+
+
+def new_request_context(request_id=None):
+    """Start a request: set its correlation id and sampling decision.
+
+    Returns the request id and a token to pass to end_request_context().
+    """
+    request_id = request_id or uuid.uuid4().hex[:16]
+    tokens = (
+        request_id_var.set(request_id),
+        sampled_var.set(random.random() < LOG_SAMPLE_RATE),
+    )
+    return request_id, tokens
+
+
+def end_request_context(tokens):
+    request_id_var.reset(tokens[0])
+    sampled_var.reset(tokens[1])
+
+
+def queue_depth():
+    """Number of records waiting to be written"""
+    if _listener is None:
+        return 0
+    return _listener.queue.qsize()
+
+
+def dropped_records():
+    """Number of records dropped because the queue was full"""
+    return NonBlockingQueueHandler.dropped
@@ -0,0 +1,123 @@
+# metrics.py
+"""
+Per-stage latency histograms and service gauges, exported in Prometheus format.
+
+Set METRICS_ENABLED=0 to turn everything into no-ops (stage() then returns a
+shared null context, so the instrumented code pays one function call).
+Metrics are also disabled when prometheus_client is not installed.
+"""
+import os
+import time
+from contextlib import nullcontext
+
+import logger
+
+try:
+    from prometheus_client import (
+        CollectorRegistry, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
+    )
+except ImportError:  # optional dependency
+    CollectorRegistry = None
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+METRICS_ENABLED = (
+    os.getenv('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+    and CollectorRegistry is not None
+)
+
+# Buckets from 1ms to 30s: covers rerank (~ms) up to cold embedding builds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+_NOOP = nullcontext()
+
+if METRICS_ENABLED:
+    registry = CollectorRegistry()
+    STAGE_LATENCY = Histogram(
+        'ml_stage_duration_seconds', 'Time spent in each pipeline stage',
+        ['stage'], buckets=LATENCY_BUCKETS, registry=registry
+    )
+    REQUEST_LATENCY = Histogram(
+        'ml_request_duration_seconds', 'End-to-end request latency per route',
+        ['route', 'method', 'status'], buckets=LATENCY_BUCKETS, registry=registry
+    )
+    INFLIGHT = Gauge(
+        'ml_inflight_requests', 'Requests currently being processed or queued',
+        registry=registry
+    )
+    CACHE_ENTRIES = Gauge(
+        'ml_cache_entries', 'Number of entries held by each in-memory cache',
+        ['cache'], registry=registry
+    )
+    DATASET_ROWS = Gauge(
+        'ml_dataset_rows', 'Number of products in the loaded dataset',
+        registry=registry
+    )
+    DATASET_INFO = Gauge(
+        'ml_dataset_info', 'Loaded dataset version (value is always 1)',
+        ['version'], registry=registry
+    )
+    LOG_QUEUE_DEPTH = Gauge(
+        'ml_log_queue_depth', 'Log records waiting to be written',
+        registry=registry
+    )
+    LOG_DROPPED = Gauge(
+        'ml_log_dropped_records', 'Log records dropped because the queue was full',
+        registry=registry
+    )
+    # Read at scrape time, so the logging hot path stays untouched
+    LOG_QUEUE_DEPTH.set_function(logger.queue_depth)
+    LOG_DROPPED.set_function(logger.dropped_records)
+else:
+    registry = None
+
+
+class _Stage:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+def stage(name):
+    """Context manager timing one pipeline stage: `with stage('knn_fit'): ...`"""
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _Stage(STAGE_LATENCY.labels(name))
+
+
+def observe_request(route, method, status, seconds):
+    if METRICS_ENABLED:
+        REQUEST_LATENCY.labels(route, method, str(status)).observe(seconds)
+
+
+def inflight(delta):
+    if METRICS_ENABLED:
+        INFLIGHT.inc(delta)
+
+
+def set_cache_entries(cache, count):
+    if METRICS_ENABLED:
+        CACHE_ENTRIES.labels(cache).set(count)
+
+
+def set_dataset(version, rows):
+    if METRICS_ENABLED:
+        DATASET_INFO.clear()
+        DATASET_INFO.labels(version).set(1)
+        DATASET_ROWS.set(rows)
+
+
+def render():
+    """Return (body, content_type) for the /metrics endpoint"""
+    if not METRICS_ENABLED:
+        return b"# metrics disabled\n", CONTENT_TYPE_LATEST
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,10 +1,32 @@
 # model.py
 import pandas as pd
 import numpy as np
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from scipy import sparse
 from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import normalize
+from metrics import stage, set_cache_entries
+from logger import get_logger
+from utils import SingleFlight
+
+log = get_logger('model')
 
 # ===== 1. Load & clean dataset =====
-df = None  # Will be loaded from database
+# Lean mode: categorical/interned strings, float32/downcast ints, normalized
+# embeddings without a second copy (see compact_frame)
+MEMORY_LEAN = os.getenv('MEMORY_LEAN', '0').lower() in ('1', 'true', 'yes')
+CATEGORICAL_MAX_RATIO = 0.5  # text columns with at most 50% distinct values -> category
+
+# The served catalogs (data, tag matrices, neighbor tables, ...) live on
+# engine.Recommender; the module-level API below wraps the default one
+
+# KNN candidates precomputed offline (artifacts.py), used instead of a per-request fit
+NEIGHBORS_K = 15          # recommend() keeps at most 15 neighbours
+NEIGHBORS_N_LIQUORS = 20  # ... of the N_liquors=20 used by find_similarities
 
 def clean_data(df):
     df = df.copy()
@@ -19,30 +41,110 @@ def clean_data(df):
             df[col] = df[col].fillna('')
     return df
 
-def load_data():
-    """Load data from database"""
-    global df
-    if df is None:
+FLAVOR_COLS = ['f1', 'f2', 'f3', 'f4', 'f5', 'f6']
+
+def mark_missing_flavors(df):
+    """Ghi lại f1..f6 nào bị null (bitmask, bit i = f{i+1}) trước khi clean_data điền median"""
+    mask = np.zeros(len(df), dtype=np.int8)
+    for bit, col in enumerate(FLAVOR_COLS):
+        if col in df.columns:
+            mask |= (df[col].isnull().values.astype(np.int8) << bit)
+        else:
+            mask |= np.int8(1 << bit)
+    df['_flavor_missing'] = mask
+    return df
+
+def compute_dataset_version(df):
+    """Short content hash of the dataset, changes whenever any row changes"""
+    hashed = pd.util.hash_pandas_object(df, index=True).values
+    return hashlib.sha1(hashed.tobytes()).hexdigest()[:12]
+
+def compact_frame(df):
+    """Lean dtypes for a cleaned catalog (in place, returns df)
+
+    - text columns with few distinct values -> category, the others keep
+      object dtype with equal strings interned
+    - integers downcast to the smallest type, floats to float32
+    """
+    for col in df.columns:
+        values = df[col]
+        if values.dtype == object or isinstance(values.dtype, pd.StringDtype):
+            if not values.map(lambda v: isinstance(v, str) or v is None or v != v).all():
+                continue  # mixed types, leave as is
+            if values.nunique(dropna=True) <= CATEGORICAL_MAX_RATIO * len(values):
+                df[col] = values.astype('category')
+            else:
+                df[col] = values.map(lambda v: sys.intern(v) if isinstance(v, str) else v)
+        elif pd.api.types.is_integer_dtype(values):
+            df[col] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values):
+            df[col] = values.astype(np.float32)
+    return df
+
+class DataSourceError(Exception):
+    """The product data of a catalog could not be read"""
+
+
+def read_source(table='products', csv_path="data/liquors.csv", csv_fallback=True):
+    """Raw product rows and the source actually read: 'table' or 'csv'
+
+    The database table comes first; the CSV file is read when table is None
+    or, with csv_fallback, when the table cannot be read.
+    """
+    if table is not None:
         try:
             from db_loader import load_data_from_db
-            print("Loading data from database...")
-            df = load_data_from_db()
-            df = clean_data(df)
-            # Create a mapping from ID to index for fast lookup
-            df['_index'] = df.index
-            print(f"Loaded {len(df)} products. ID range: {df['id'].min()} - {df['id'].max()}")
+            log.info("Loading data from database...")
+            return load_data_from_db(table, csv_fallback=False), 'table'
         except Exception as e:
-            print(f"Error loading from database: {e}")
-            print("Falling back to CSV...")
-            df = pd.read_csv("data/liquors.csv")
-            df = clean_data(df)
-            df['_index'] = df.index
-    return df
+            if not csv_fallback or csv_path is None:
+                raise DataSourceError(f"Cannot read table '{table}': {e}") from e
+            log.warning("Error loading from database: %s. Falling back to CSV...", e)
+    if csv_path is None:
+        raise DataSourceError("No table or CSV file configured")
+    try:
+        return pd.read_csv(csv_path), 'csv'
+    except (OSError, ValueError) as e:  # missing file, bad encoding or format
+        raise DataSourceError(f"Cannot read CSV file '{csv_path}': {e}") from e
+
+def check_source(table, csv_path):
+    """Raise DataSourceError unless a CSV file is configured or the table can be read"""
+    if csv_path is not None:
+        if table is None and not os.path.exists(csv_path):
+            raise DataSourceError(f"CSV file '{csv_path}' not found")
+        return
+    if table is None:
+        raise DataSourceError("No table or CSV file configured")
+    try:
+        from db_loader import check_table
+        check_table(table)
+    except Exception as e:
+        raise DataSourceError(f"Cannot read table '{table}' and no CSV file is configured: {e}") from e
+
+def prepare_dataset(data):
+    """Clean raw product rows (see read_source)"""
+    data = mark_missing_flavors(data)
+    data = clean_data(data)
+    # Create a mapping from ID to index for fast lookup
+    data['_index'] = data.index
+    log.info("Loaded %d products. ID range: %s - %s", len(data), data['id'].min(), data['id'].max())
+    return data
+
+def read_dataset(table='products', csv_path="data/liquors.csv", csv_fallback=True):
+    """Read and clean the product data (database first, CSV fallback)
+
+    With table=None the CSV file is the only source.
+    """
+    return prepare_dataset(read_source(table, csv_path, csv_fallback)[0])
+
+def load_data():
+    """Load data from database"""
+    from engine import default_engine
+    return default_engine().ensure_loaded()
 
 # ===== 2. TẤT CẢ function ML của bạn =====
 # Duplicate imports and the second `clean_data` definition were removed.
-# The dataset was already read and cleaned above into `df`, so reuse it.
-df_initial = df
+# The dataset is read and cleaned above (read_dataset / load_data).
 
 # Hàm gaussian filter để tính độ tương đồng
 def gaussian_filter(value_ref, value_current, sigma):
@@ -76,69 +178,69 @@ def entry_variables(df, id_entry):
 
 
 # Function to add variables to dataframe
-def add_variables(df, REF_VAR):
-    """Chuyển đổi dữ liệu thành ma trận binary (one-hot encoding)"""
-    df = df.copy()
-    
-    # Tạo các cột mới với giá trị 0
-    for s in REF_VAR:
-        df[s] = 0
-    
-    columns = ['brand_name', 'flavour_tags']
-    
-    for index, row in df.iterrows():
-        for category in columns:
-            data = row[category]
-            if pd.isnull(data) or data == '': 
-                continue
-            
-            if category == 'brand_name':
-                if data in REF_VAR:
-                    df.at[index, data] = 1
-            else:
-                # Xử lý flavour_tags
-                for tag in str(data).split('|'):
-                    tag = tag.strip()
-                    if tag and tag in REF_VAR:
-                        df.at[index, tag] = 1
-    
-    return df
+def add_variables(df, REF_VAR, tags=None):
+    """Chuyển đổi dữ liệu thành ma trận binary (one-hot encoding)
+
+    Returns the N x len(REF_VAR) float matrix (a repeated label gives a
+    repeated column), sliced from the precomputed tag matrix instead of
+    adding columns to a copy of df.
+    """
+    matrix, vocab = tags if tags is not None else compute_tag_matrix(df)
+    return matrix[:, [vocab[label] for label in REF_VAR]].toarray().astype(float)
 
 
 # Function create N liquors similar with liquor given by user
-def recommend(df, id_entry, N_liquors):
-    """Tìm N liquors tương tự nhất sử dụng KNN"""
-    df_copy = df.copy()
-    variables = entry_variables(df_copy, id_entry)
+def recommend(df, id_entry, N_liquors, tags=None, neighbors=None, keep=NEIGHBORS_K):
+    """Tìm N liquors tương tự nhất sử dụng KNN (giữ lại `keep` liquors gần nhất)"""
+    if neighbors is not None and N_liquors == NEIGHBORS_N_LIQUORS and neighbors[id_entry, 0] >= 0:
+        row = neighbors[id_entry]
+        return row[row >= 0]
+
+    variables = entry_variables(df, id_entry)
     
     # Nếu không có đặc trưng nào, trả về các liquor ngẫu nhiên
     if len(variables) == 0:
-        print("Warning: No valid features found. Returning random samples.")
+        log.warning("No valid features found. Returning random samples.")
         indices = np.random.choice(len(df), min(N_liquors, len(df)), replace=False)
         return indices
     
-    df_new = add_variables(df_copy, variables)
-    
     # Lấy ma trận đặc trưng
-    X = df_new[variables].values.astype(float)
+    with stage('add_variables'):
+        X = add_variables(df, variables, tags)
     
     # Kiểm tra NaN
     if np.isnan(X).any():
         X = np.nan_to_num(X, nan=0.0)
     
     # Tạo model KNN
-    nbrs = NearestNeighbors(n_neighbors=min(N_liquors, len(df)), 
-                           algorithm='auto', 
-                           metric='euclidean').fit(X)
+    with stage('knn_fit'):
+        nbrs = NearestNeighbors(n_neighbors=min(N_liquors, len(df)), 
+                               algorithm='auto', 
+                               metric='euclidean').fit(X)
     
     # Tìm neighbors cho liquor được chọn
-    x_test = df_new.iloc[id_entry][variables].values.astype(float)
-    x_test = np.nan_to_num(x_test, nan=0.0)
-    x_test = x_test.reshape(1, -1)
+    x_test = X[id_entry].reshape(1, -1)
     
-    distances, indices = nbrs.kneighbors(x_test)
+    with stage('knn_query'):
+        distances, indices = nbrs.kneighbors(x_test)
     
-    return indices[0][:min(15, len(indices[0]))]
+    return indices[0][:min(keep, len(indices[0]))]
+
+
+def compute_neighbor_table(df, tags=None, progress=None):
+    """KNN candidates of every product, as recommend() would return them
+
+    Products without features keep a row of -1 (recommend() samples them live).
+    """
+    tags = tags if tags is not None else compute_tag_matrix(df)
+    table = np.full((len(df), NEIGHBORS_K), -1, dtype=np.int32)
+    for pos in range(len(df)):
+        if entry_variables(df, pos):
+            indices = recommend(df, pos, NEIGHBORS_N_LIQUORS, tags)
+            table[pos, :len(indices)] = indices
+        if progress is not None:
+            progress(pos + 1, len(df))
+    return table
 
 
 # Function give a mark to a liquor
@@ -170,33 +272,29 @@ def new_critere_selection(brand_main, max_checkin, score,
 
 
 # Function extract parameters from liquor list
-def new_extract_parameters(df, list_liquors, N_liquors):
-    """Trích xuất thông tin và sắp xếp kết quả"""
-    list_parameters = []
-    max_checkin = -1
-    
-    for index in list_liquors:
-        row = df.iloc[index]
-        params = [
-            row['brand_name'],
-            row['score'],
-            row['f1'], row['f2'], row['f3'],
-            row['f4'], row['f5'], row['f6'],
-            row['name'],
-            row['checkin_count'],
-            index
-        ]
-        list_parameters.append(params)
-        max_checkin = max(max_checkin, int(row['checkin_count']))
+def selection_entry(df, index):
+    """[brand, score, f1..f6, name, checkin_count, index] của một liquor"""
+    row = df.iloc[index]
+    return [
+        row['brand_name'], row['score'],
+        row['f1'], row['f2'], row['f3'], row['f4'], row['f5'], row['f6'],
+        row['name'], row['checkin_count'], index
+    ]
+
+def new_extract_parameters(df, list_liquors, N_liquors, reference_flavors=None):
+    """Trích xuất thông tin và sắp xếp kết quả
+
+    reference_flavors: flavor profile the candidates are reranked against
+    (default: the first liquor, i.e. the query product)
+    """
+    list_parameters = [selection_entry(df, index) for index in list_liquors]
+    max_checkin = max((int(x[9]) for x in list_parameters), default=-1)
     
     # Lấy giá trị tham chiếu từ liquor đầu tiên (liquor gốc)
     brand_main = list_parameters[0][0]
-    max_f1 = list_parameters[0][2]
-    max_f2 = list_parameters[0][3]
-    max_f3 = list_parameters[0][4]
-    max_f4 = list_parameters[0][5]
-    max_f5 = list_parameters[0][6]
-    max_f6 = list_parameters[0][7]
+    if reference_flavors is None:
+        reference_flavors = list_parameters[0][2:8]
+    max_f1, max_f2, max_f3, max_f4, max_f5, max_f6 = reference_flavors
     
     # Sắp xếp theo điểm
     list_parameters.sort(
@@ -211,60 +309,59 @@ def new_extract_parameters(df, list_liquors, N_liquors):
 
 
 # Function returns sorted list of similarities
-def add_to_selection(liquor_selection, list_parameters, N_liquors):
-    """Loại bỏ trùng lặp và giới hạn kết quả top 5"""
+def add_to_selection(liquor_selection, list_parameters, N_liquors, limit=5):
+    """Loại bỏ trùng lặp theo tên và giới hạn kết quả (mặc định top 5)
+
+    Extends liquor_selection up to `limit` entries, skipping names that are
+    already selected (hash set lookup, also across the added entries).
+    """
     liquor_list = liquor_selection[:]
-    icount = len(liquor_list)
+    taken = {s[8] for s in liquor_selection}
     
-    for i in range(min(len(list_parameters), N_liquors)):
-        already_in_list = False
-        
+    for params in list_parameters[:N_liquors]:
+        if len(liquor_list) >= limit:
+            break
         # Kiểm tra trùng lặp theo tên
-        for s in liquor_selection:
-            if s[8] == list_parameters[i][8]:  # So sánh tên
-                already_in_list = True
-                break
-        
-        if already_in_list:
+        if params[8] in taken:
             continue
-        
-        icount += 1
-        if icount <= 5:
-            liquor_list.append(list_parameters[i])
+        taken.add(params[8])
+        liquor_list.append(params)
     
     return liquor_list
 
 
 # Function to find top 5 most similar products
-def find_similarities(df, id_entry, N_liquors=20, del_sequel=True, verbose=False):
+def find_similarities(df, id_entry, N_liquors=20, del_sequel=True, verbose=False, tags=None,
+                      neighbors=None):
     """Hàm chính để tìm top 5 liquors tương tự"""
     if verbose:
-        print(90*'-')
-        print('QUERY: liquors similar to id={} -> "{}"'.format(
-            id_entry, df.iloc[id_entry]['brand_name']))
-        print(f"Name: {df.iloc[id_entry]['name']}")
-        print(90*'-')
+        log.debug('QUERY: liquors similar to id=%s -> "%s" (name: %s)',
+                  id_entry, df.iloc[id_entry]['brand_name'], df.iloc[id_entry]['name'])
     
     # Tìm liquors tương tự
-    list_liquors = recommend(df, id_entry, N_liquors)
+    list_liquors = recommend(df, id_entry, N_liquors, tags, neighbors)
     
     if verbose:
-        print(f"Found {len(list_liquors)} similar liquors")
+        log.debug("Found %d similar liquors", len(list_liquors))
     
     # Trích xuất thông tin và sắp xếp
-    list_parameters = new_extract_parameters(df, list_liquors, N_liquors)
-    
-    # Lọc và lấy top 5
-    liquor_selection = []
-    liquor_selection = add_to_selection(liquor_selection, list_parameters, N_liquors)
+    with stage('rerank'):
+        list_parameters = new_extract_parameters(df, list_liquors, N_liquors)
+        
+        # Lọc và lấy top 5
+        liquor_selection = []
+        liquor_selection = add_to_selection(liquor_selection, list_parameters, N_liquors)
     
-    # Hiển thị kết quả
+    return build_selection_results(df, liquor_selection, verbose)
+
+
+# Function build API records from a (re)ranked selection
+def build_selection_results(df, liquor_selection, verbose=False, offset=0):
+    """Chuyển danh sách đã xếp hạng thành kết quả trả về cho API
+
+    offset: rank of the first entry minus one (pages of a longer ranking)
+    """
     selection_results = []
-    if verbose:
-        print(f"\n{'='*90}")
-        print("TOP 5 SIMILAR LIQUORS:")
-        print(f"{'='*90}")
-    
     for i, s in enumerate(liquor_selection):
         # Get full product info from dataframe
         product_idx = int(s[10])  # index in dataframe
@@ -299,7 +396,7 @@ def find_similarities(df, id_entry, N_liquors=20, del_sequel=True, verbose=False
                 return []
         
         result = {
-            'rank': int(i + 1),
+            'rank': int(offset + i + 1),
             'id': int(safe_get('id', 0)) if safe_get('id') is not None else None,
             'brand': str(s[0]) if s[0] else None,
             'brand_intl_name': safe_get('brand_intl_name'),
@@ -324,13 +421,136 @@ def find_similarities(df, id_entry, N_liquors=20, del_sequel=True, verbose=False
         selection_results.append(result)
         
         if verbose:
-            print(f"\n{i+1}. {s[8]} ({s[0]})")
-            print(f"   Score: {s[1]:.2f} | Check-ins: {s[9]}")
-            print(f"   Flavors: f1={s[2]:.3f}, f2={s[3]:.3f}, f3={s[4]:.3f}, f4={s[5]:.3f}, f5={s[6]:.3f}, f6={s[7]:.3f}")
+            log.debug("%d. %s (%s) | Score: %.2f | Check-ins: %s | "
+                      "Flavors: f1=%.3f, f2=%.3f, f3=%.3f, f4=%.3f, f5=%.3f, f6=%.3f",
+                      i + 1, s[8], s[0], s[1], s[9], s[2], s[3], s[4], s[5], s[6], s[7])
     
     return selection_results
 
 
+# ===== 2b. Tag feature space & multi-seed recommendations =====
+# Weights of each signal in the aggregated "more like these" query
+MULTI_SEED_WEIGHTS = {'tags': 1.0, 'flavor': 1.0, 'text': 1.0}
+DISLIKE_WEIGHT = 0.5      # Rocchio-style: liked centroid - 0.5 * disliked centroid
+MULTI_SEED_CANDIDATES = 20  # candidates passed to the Gaussian rerank (>= top_k)
+
+def compute_tag_matrix(df):
+    """Ma trận multi-hot brand + flavour_tags cho toàn bộ dataset (cùng nhãn như entry_variables)
+
+    Returns (CSR matrix N x V float32, vocab label -> column)
+    """
+    vocab = {}
+    rows, cols = [], []
+    for pos, (brand, tags) in enumerate(zip(df['brand_name'], df['flavour_tags'])):
+        labels = set()
+        if isinstance(brand, str) and brand != '':
+            labels.add(brand)
+        if isinstance(tags, str) and tags != '':
+            labels.update(t.strip() for t in tags.split('|') if t.strip())
+        for label in labels:
+            rows.append(pos)
+            cols.append(vocab.setdefault(label, len(vocab)))
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(len(df), len(vocab))
+    )
+    return matrix, vocab
+
+def ids_to_positions(df, product_ids):
+    """Map product IDs to row positions, raising ValueError for unknown IDs"""
+    positions = pd.Index(df['id']).get_indexer(list(product_ids))
+    missing = [pid for pid, pos in zip(product_ids, positions) if pos < 0]
+    if missing:
+        raise ValueError(f"Products with IDs {missing} not found in dataset")
+    return positions
+
+def _seed_query(matrix, liked, disliked):
+    """Aggregated, normalized query vector: mean(liked) - DISLIKE_WEIGHT * mean(disliked)"""
+    q = np.asarray(matrix[liked].mean(axis=0)).ravel()
+    if len(disliked):
+        q = q - DISLIKE_WEIGHT * np.asarray(matrix[disliked].mean(axis=0)).ravel()
+    norm = np.linalg.norm(q)
+    return q / norm if norm > 0 else q
+
+def catalog_signals(df):
+    """(name, row-normalized matrix) for the tag and flavor signals of df, computed on the spot"""
+    from flavor_search import compute_flavor_matrix
+    return [('tags', normalize(compute_tag_matrix(df)[0])), ('flavor', compute_flavor_matrix(df)[2])]
+
+def multi_seed_scores(df, liked, disliked=(), weights=None, signals=None):
+    """
+    Score every product against a set of liked (and disliked) row positions
+
+    Each signal (tag overlap, flavor vector, text embeddings when loaded) gives
+    a cosine similarity to the aggregated seed query; the weighted sum is
+    computed in one vectorized pass per signal.
+    """
+    weights = dict(MULTI_SEED_WEIGHTS, **(weights or {}))
+    liked, disliked = np.asarray(liked), np.asarray(disliked, dtype=np.int64)
+    if signals is None:
+        signals = catalog_signals(df)
+
+    scores = np.zeros(len(df), dtype=np.float32)
+    total_weight = 0.0
+    for name, matrix in signals:
+        w = weights.get(name, 0.0)
+        if w <= 0:
+            continue
+        q = _seed_query(matrix, liked, disliked)
+        scores += w * np.asarray(matrix @ q, dtype=np.float32).ravel()
+        total_weight += w
+    return scores / total_weight if total_weight else scores
+
+def recommend_by_ids(liked_ids, disliked_ids=None, top_k=5, weights=None):
+    """
+    "More like these": recommendations for a set of liked (and disliked) product IDs
+
+    Args:
+        liked_ids: Product IDs the user likes (at least one)
+        disliked_ids: Optional product IDs to steer away from
+        top_k: Number of products to return (at least 1)
+        weights: Optional override of MULTI_SEED_WEIGHTS
+
+    Returns:
+        List of recommended products (seeds and their other listings excluded)
+    """
+    from engine import default_engine
+    return default_engine().more_like_these(liked_ids, disliked_ids, top_k, weights)
+
+def more_like_these(df_local, liked_ids, disliked_ids=None, top_k=5, weights=None, signals=None):
+    """recommend_by_ids over any catalog DataFrame
+
+    signals: (name, row-normalized matrix) per signal (default: catalog_signals)
+    """
+    if not liked_ids:
+        raise ValueError("At least one liked product ID is required")
+    if top_k < 1:
+        raise ValueError("top_k must be at least 1")
+    disliked_ids = disliked_ids or []
+    liked = ids_to_positions(df_local, liked_ids)
+    disliked = ids_to_positions(df_local, disliked_ids)
+
+    with stage('multi_seed_scores'):
+        scores = multi_seed_scores(df_local, liked, disliked, weights, signals)
+        # The seeds and other listings with a seed's name are not recommendations
+        seeds = np.concatenate([liked, disliked])
+        scores[df_local['name'].isin(df_local['name'].iloc[seeds].unique()).to_numpy()] = -np.inf
+
+        n_valid = int(np.isfinite(scores).sum())
+        n_candidates = min(max(MULTI_SEED_CANDIDATES, 4 * top_k), n_valid)
+        if n_candidates <= 0:
+            return []
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    with stage('rerank'):
+        reference = df_local.iloc[liked][FLAVOR_COLS].mean().values
+        list_parameters = new_extract_parameters(df_local, candidates, len(candidates), reference)
+        selection = add_to_selection([], list_parameters, len(list_parameters), limit=top_k)
+
+    return build_selection_results(df_local, selection)
+
+
 # ===== 3. API function dùng cho FastAPI =====
 def recommend_by_id(product_id):
     """
@@ -342,8 +562,14 @@ def recommend_by_id(product_id):
     Returns:
         List of recommended products
     """
-    df_local = load_data()
-    
+    from engine import default_engine
+    return default_engine().recommend(product_id)
+
+def similar_products(df_local, product_id, tags=None, neighbors=None):
+    """recommend_by_id over any catalog DataFrame
+
+    tags: its compute_tag_matrix output; neighbors: its compute_neighbor_table output
+    """
     # Convert product ID to dataframe index
     product_rows = df_local[df_local['id'] == product_id]
     
@@ -353,8 +579,124 @@ def recommend_by_id(product_id):
     # Get the dataframe index (row position) for this product ID
     product_index = product_rows.index[0]
     
-    print(f"Product ID {product_id} found at index {product_index}")
+    log.debug("Product ID %s found at index %s", product_id, product_index)
     
     # Use the index for similarity search
-    return find_similarities(df_local, product_index)
+    with stage('find_similarities'):
+        return find_similarities(df_local, product_index, tags=tags, neighbors=neighbors)
+
+
+
+# ===== 4. Pagination ("show more") =====
+RANKING_DEPTH = int(os.getenv('RECOMMEND_RANKING_DEPTH', '100'))  # nearest neighbours ranked for paging
+PAGE_SIZE = int(os.getenv('RECOMMEND_PAGE_SIZE', '5'))
+MAX_PAGE_SIZE = int(os.getenv('RECOMMEND_MAX_PAGE_SIZE', '50'))
+RANKING_CACHE_SIZE = int(os.getenv('RECOMMEND_RANKING_CACHE_SIZE', '2048'))  # products
+
+def ranked_similarities(df, id_entry, depth=RANKING_DEPTH, tags=None, neighbors=None):
+    """Full ranking behind find_similarities, for pagination
+
+    Starts with exactly the find_similarities selection (top 5 of the 15
+    nearest after the rerank), followed by the `depth` nearest neighbours in
+    rerank order. Each name appears once.
+    """
+    head_candidates = recommend(df, id_entry, NEIGHBORS_N_LIQUORS, tags, neighbors)
+    head = add_to_selection([], new_extract_parameters(df, head_candidates, NEIGHBORS_N_LIQUORS),
+                            NEIGHBORS_N_LIQUORS)
+    if depth <= NEIGHBORS_K:
+        return head
+
+    candidates = recommend(df, id_entry, depth, tags, keep=depth)
+    deep = new_extract_parameters(df, candidates, len(candidates))
+    return add_to_selection(head, deep, len(deep), limit=len(head) + len(deep))
+
+class RankingCache:
+    """ranked_similarities per (dataset version, product id), least recently used first
+
+    One per catalog (engine.Recommender), so it is freed with the catalog and
+    counted in its memory report.
+    """
+
+    def __init__(self, name='rankings', size=None):
+        self.name = name
+        self.size = RANKING_CACHE_SIZE if size is None else size
+        self.nbytes = 0  # approximate, updated on insert/evict
+        self._rankings = OrderedDict()  # key -> (ranked selection, bytes)
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def __len__(self):
+        return len(self._rankings)
+
+    def get(self, df_local, version, product_id, tags=None, neighbors=None):
+        """ranked_similarities of a product, computed once per (dataset version, product)"""
+        key = (version, int(product_id))
+        with self._lock:
+            entry = self._rankings.get(key)
+            if entry is not None:
+                self._rankings.move_to_end(key)
+                return entry[0]
 
+        def compute():
+            position = int(ids_to_positions(df_local, [product_id])[0])
+            with stage('ranked_similarities'):
+                ranking = ranked_similarities(df_local, position, tags=tags, neighbors=neighbors)
+            size = ranking_bytes(ranking)
+            with self._lock:
+                if key not in self._rankings:
+                    self._rankings[key] = (ranking, size)
+                    self.nbytes += size
+                while len(self._rankings) > self.size:
+                    self.nbytes -= self._rankings.popitem(last=False)[1][1]
+                set_cache_entries(self.name, len(self._rankings))
+            return ranking
+
+        return self._flight.do(key, compute)
+
+    def clear(self):
+        with self._lock:
+            self._rankings.clear()
+            self.nbytes = 0
+        set_cache_entries(self.name, 0)
+
+def ranking_bytes(ranking):
+    """Approximate memory of a ranked selection (list of selection entries)"""
+    return sys.getsizeof(ranking) + sum(
+        sys.getsizeof(entry) + sum(sys.getsizeof(v) for v in entry) for entry in ranking)
+
+def similar_products_page(df_local, version, product_id, offset=0, limit=None, tags=None,
+                          neighbors=None, rankings=None):
+    """
+    One page of the similar-product ranking: (results, total)
+
+    rankings: the catalog's RankingCache; later pages are slices of the cached
+    ranking (without one, the ranking is computed for every page). Ranks
+    continue across pages.
+    """
+    limit = PAGE_SIZE if limit is None else limit
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"Page size must be between 1 and {MAX_PAGE_SIZE}")
+    if offset < 0:
+        raise ValueError("Offset must not be negative")
+    if rankings is None:
+        position = int(ids_to_positions(df_local, [product_id])[0])
+        ranking = ranked_similarities(df_local, position, tags=tags, neighbors=neighbors)
+    else:
+        ranking = rankings.get(df_local, version, product_id, tags, neighbors)
+    page = ranking[offset:offset + limit]
+    return build_selection_results(df_local, page, offset=offset), len(ranking)
+
+def recommend_page(product_id, offset=0, limit=None):
+    """
+    Paginated recommend_by_id
+
+    Args:
+        product_id: The actual product ID from database
+        offset: Position of the first result in the ranking
+        limit: Page size (default PAGE_SIZE, at most MAX_PAGE_SIZE)
+
+    Returns:
+        (results, total): the page, and the length of the whole ranking
+    """
+    from engine import default_engine
+    return default_engine().recommend_page(product_id, offset, limit)
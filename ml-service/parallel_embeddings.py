@@ -0,0 +1,191 @@
+# parallel_embeddings.py
+"""
+Parallel, resumable embedding builds.
+
+The catalog descriptions are split into fixed-size chunks and encoded in a
+process pool. Each worker loads its own SentenceTransformer with a bounded
+number of torch threads (workers x threads <= cores) and writes its rows
+straight into a preallocated on-disk .npy matrix. After every finished chunk
+the parent records it in a checkpoint file, so a crashed or killed build
+resumes with the missing chunks only.
+
+Used by semantic_search.encode_catalog when EMBEDDINGS_BUILD_MODE=parallel,
+or offline (default catalog):
+    python parallel_embeddings.py --workers 8 --threads-per-worker 2
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from logger import get_logger
+from utils import atomic_write
+
+log = get_logger('parallel_embeddings')
+
+BUILD_DIR = os.getenv('EMBEDDINGS_BUILD_DIR', 'data/embeddings_build')
+CHUNK_SIZE = int(os.getenv('EMBEDDINGS_CHUNK_SIZE', '1024'))
+THREADS_PER_WORKER = int(os.getenv('EMBEDDINGS_THREADS_PER_WORKER', '1'))
+WORKERS = int(os.getenv('EMBEDDINGS_WORKERS', '0'))  # 0 = cores // threads per worker
+
+MATRIX_FILE = 'embeddings.npy'
+CHECKPOINT_FILE = 'checkpoint.json'
+
+# ===== Worker side =====
+_worker_model = None
+
+
+def _init_worker(model_name, threads):
+    """Limit intra-op threads before torch is imported, then load the model"""
+    global _worker_model
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _encode_chunk(matrix_path, chunk_id, start, texts, batch_size):
+    """Encode one chunk and write its rows into the shared .npy file"""
+    embeddings = _worker_model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+    matrix = np.load(matrix_path, mmap_mode='r+')
+    matrix[start:start + len(texts)] = np.asarray(embeddings, dtype=np.float32)
+    matrix.flush()
+    del matrix
+    return chunk_id, len(texts)
+
+
+# ===== Parent side =====
+def build_fingerprint(descriptions, model_name, chunk_size):
+    """Identifies a build: same texts + model + chunking -> resumable"""
+    h = hashlib.sha1()
+    h.update(model_name.encode('utf-8'))
+    h.update(str(chunk_size).encode('ascii'))
+    for text in descriptions:
+        h.update(text.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _read_checkpoint(build_dir):
+    try:
+        with open(os.path.join(build_dir, CHECKPOINT_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_checkpoint(build_dir, checkpoint):
+    with atomic_write(os.path.join(build_dir, CHECKPOINT_FILE), 'w') as f:
+        json.dump(checkpoint, f)
+
+
+def default_workers(threads_per_worker):
+    return max(1, (os.cpu_count() or 1) // max(1, threads_per_worker))
+
+
+def build_embeddings_parallel(descriptions, model_name, dim, workers=None,
+                              threads_per_worker=None, chunk_size=None,
+                              build_dir=None, batch_size=64, progress=None):
+    """
+    Encode descriptions in a process pool, resuming an interrupted build
+
+    Args:
+        descriptions: List of product description strings
+        model_name: SentenceTransformer model to load in each worker
+        dim: Embedding dimension (to preallocate the on-disk matrix)
+        workers: Worker processes (default: cores // threads_per_worker)
+        threads_per_worker: torch threads per worker (default 1)
+        chunk_size: Rows per chunk / checkpoint unit (default 1024)
+        build_dir: Where the matrix and checkpoint live
+        progress: Optional callback(done_rows, total_rows)
+
+    Returns:
+        float32 array of shape (len(descriptions), dim)
+    """
+    threads_per_worker = threads_per_worker or THREADS_PER_WORKER
+    workers = workers or WORKERS or default_workers(threads_per_worker)
+    chunk_size = chunk_size or CHUNK_SIZE
+    build_dir = build_dir or BUILD_DIR
+    total = len(descriptions)
+    matrix_path = os.path.join(build_dir, MATRIX_FILE)
+    fingerprint = build_fingerprint(descriptions, model_name, chunk_size)
+    n_chunks = (total + chunk_size - 1) // chunk_size
+
+    os.makedirs(build_dir, exist_ok=True)
+    checkpoint = _read_checkpoint(build_dir)
+    if (checkpoint is None or checkpoint.get('fingerprint') != fingerprint
+            or checkpoint.get('dim') != dim or not os.path.exists(matrix_path)):
+        # New build: preallocate the matrix, then record an empty checkpoint
+        np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float32, shape=(total, dim)).flush()
+        checkpoint = {'fingerprint': fingerprint, 'model': model_name, 'rows': total,
+                      'dim': dim, 'chunk_size': chunk_size, 'done_chunks': []}
+        _write_checkpoint(build_dir, checkpoint)
+    else:
+        log.info("Resuming embedding build: %d/%d chunks already done",
+                 len(checkpoint['done_chunks']), n_chunks)
+
+    done_chunks = set(checkpoint['done_chunks'])
+    pending = [c for c in range(n_chunks) if c not in done_chunks]
+    done_rows = sum(min(chunk_size, total - c * chunk_size) for c in done_chunks)
+    if progress is not None:
+        progress(done_rows, total)
+
+    if pending:
+        log.info("Encoding %d chunks of %d rows with %d workers x %d threads",
+                 len(pending), chunk_size, workers, threads_per_worker)
+        ctx = mp.get_context('spawn')  # fork after torch init can deadlock
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending)), mp_context=ctx,
+                                 initializer=_init_worker,
+                                 initargs=(model_name, threads_per_worker)) as pool:
+            futures = [
+                pool.submit(_encode_chunk, matrix_path, c, c * chunk_size,
+                            descriptions[c * chunk_size:(c + 1) * chunk_size], batch_size)
+                for c in pending
+            ]
+            for future in as_completed(futures):
+                chunk_id, rows = future.result()
+                done_chunks.add(chunk_id)
+                done_rows += rows
+                checkpoint['done_chunks'] = sorted(done_chunks)
+                _write_checkpoint(build_dir, checkpoint)
+                if progress is not None:
+                    progress(done_rows, total)
+
+    return np.array(np.load(matrix_path, mmap_mode='r'), dtype=np.float32)
+
+
+def clear_build(build_dir=None):
+    """Remove the matrix and checkpoint once the embeddings are cached"""
+    shutil.rmtree(build_dir or BUILD_DIR, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the catalog embeddings in parallel")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--threads-per-worker', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=None)
+    args = parser.parse_args()
+
+    from engine import default_engine
+
+    default_engine().build_embeddings(
+        mode='parallel',
+        parallel_options={'workers': args.workers,
+                          'threads_per_worker': args.threads_per_worker,
+                          'chunk_size': args.chunk_size},
+    )
+
+
+if __name__ == "__main__":
+    main()
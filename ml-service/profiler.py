@@ -0,0 +1,242 @@
+# profiler.py
+"""
+On-demand profiling of a live worker.
+
+A profiling session runs either for a fixed duration or until the next N
+requests to a route have finished:
+
+- mode="sampling": a background thread samples the Python stacks of the
+  request threads every `interval` seconds and aggregates them in collapsed
+  stack format ("outer;inner;leaf count"), ready for flamegraph.pl/speedscope.
+- mode="cprofile": every request handled during the session runs under its
+  own cProfile.Profile (cProfile only sees the thread it was enabled in), and
+  the per-request stats are merged into one pstats.Stats.
+
+Request handlers opt in with `with profile_request('recommend'): ...`, streamed
+responses with `profile_stream('recommend-by-text-batch', body)`; when no
+session is active these return a shared null context / the body unchanged.
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+MODES = ('sampling', 'cprofile')
+MAX_DURATION = 300.0
+MAX_REQUESTS = 10000
+
+_NOOP = nullcontext()
+_session = None
+_session_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profiling session is already running"""
+
+
+class ProfileSession:
+    def __init__(self, mode, route=None, duration=10.0, requests=None, interval=0.005):
+        self.mode = mode
+        self.route = route
+        self.duration = duration
+        self.requests = requests
+        self.interval = interval
+
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.completed = 0
+        self.active_threads = set()   # thread idents currently inside a matching request
+        self.stacks = Counter()       # sampling: collapsed stack -> sample count
+        self.samples = 0
+        self.stats = None             # cprofile: merged pstats.Stats
+        self.started_at = None
+        self.elapsed = 0.0
+
+    def matches(self, route):
+        return self.route is None or self.route == route
+
+    # ----- request hooks -----
+    def enter(self):
+        with self.lock:
+            self.active_threads.add(threading.get_ident())
+
+    def exit(self, profile=None, finished=True):
+        """finished=False: one step of a streamed request, which goes on"""
+        with self.lock:
+            self.active_threads.discard(threading.get_ident())
+            if profile is not None:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+            if finished:
+                self._finish()
+
+    def finish(self):
+        """End of a streamed request (see profile_stream)"""
+        with self.lock:
+            self._finish()
+
+    def _finish(self):
+        self.completed += 1
+        if self.requests is not None and self.completed >= self.requests:
+            self.done.set()
+
+    # ----- sampling -----
+    def _sample_loop(self):
+        while not self.done.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                idents = set(self.active_threads)
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[_collapse(frame)] += 1
+                    self.samples += 1
+
+    def run(self):
+        """Block until the session finishes, then return self"""
+        self.started_at = time.time()
+        sampler = None
+        if self.mode == 'sampling':
+            sampler = threading.Thread(target=self._sample_loop, name='profiler-sampler', daemon=True)
+            sampler.start()
+        self.done.wait(self.duration)
+        self.done.set()
+        if sampler is not None:
+            sampler.join()
+        self.elapsed = time.time() - self.started_at
+        return self
+
+    # ----- output -----
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def pstats_text(self, sort='cumulative', limit=80):
+        if self.stats is None:
+            return "no requests were profiled\n"
+        out = io.StringIO()
+        self.stats.stream = out
+        self.stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def pstats_dump(self):
+        """Marshalled stats, loadable with pstats.Stats(path) / snakeviz"""
+        if self.stats is None:
+            return marshal.dumps({})
+        return marshal.dumps(self.stats.stats)
+
+    def summary(self):
+        return {
+            'mode': self.mode,
+            'route': self.route,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'requests_profiled': self.completed,
+            'samples': self.samples,
+        }
+
+
+def _collapse(frame):
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    parts.reverse()
+    return ";".join(parts)
+
+
+class _RequestCapture:
+    __slots__ = ('session', 'profile', 'finished')
+
+    def __init__(self, session, finished=True):
+        self.session = session
+        self.profile = None
+        self.finished = finished
+
+    def __enter__(self):
+        self.session.enter()
+        if self.session.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.profile is not None:
+            self.profile.disable()
+        self.session.exit(self.profile, self.finished)
+        return False
+
+
+def profile_request(route):
+    """Wrap a request handler body; profiled only while a matching session is active"""
+    session = _session
+    if session is None or session.done.is_set() or not session.matches(route):
+        return _NOOP
+    return _RequestCapture(session)
+
+
+def profile_stream(route, iterable):
+    """Wrap the body iterator of a streamed response
+
+    Each step is profiled on the thread that runs it (a sync generator moves
+    between threadpool threads); the whole stream counts as one request.
+    """
+    session = _session
+    if session is None or session.done.is_set() or not session.matches(route):
+        return iterable
+    return _profiled_steps(session, iter(iterable))
+
+
+def _profiled_steps(session, iterator):
+    try:
+        while not session.done.is_set():
+            with _RequestCapture(session, finished=False):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+        # The session ended mid-stream: send the rest unprofiled
+        yield from iterator
+    finally:
+        session.finish()
+
+
+def run_session(mode='sampling', route=None, duration=10.0, requests=None, interval=0.005):
+    """
+    Run one profiling session and return it once finished
+
+    Args:
+        mode: "sampling" (collapsed stacks) or "cprofile" (pstats)
+        route: Only profile this route (None = every profiled route)
+        duration: Maximum session length in seconds
+        requests: Stop after this many matching requests (None = duration only)
+        interval: Sampling interval in seconds (sampling mode)
+    """
+    global _session
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}")
+    if not 0 < duration <= MAX_DURATION:
+        raise ValueError(f"duration must be in (0, {MAX_DURATION}]")
+    if requests is not None and not 0 < requests <= MAX_REQUESTS:
+        raise ValueError(f"requests must be in (0, {MAX_REQUESTS}]")
+    if not 0.0005 <= interval <= 1.0:
+        raise ValueError("interval must be between 0.0005 and 1.0 seconds")
+
+    session = ProfileSession(mode, route, duration, requests, interval)
+    with _session_lock:
+        if _session is not None:
+            raise ProfilerBusy("A profiling session is already running")
+        _session = session
+    try:
+        return session.run()
+    finally:
+        with _session_lock:
+            _session = None
@@ -1,22 +1,48 @@
 # semantic_search.py
 import pandas as pd
 import numpy as np
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
 import pickle
 import os
+import re
+from metrics import stage
+from logger import get_logger
+from utils import SingleFlight, atomic_write
 
-# Global variables
+log = get_logger('semantic_search')
+
+CACHE_PATH = "data/embeddings_cache.pkl"
+# Rebuild the catalog embeddings in a background thread and serve degraded
+# results meanwhile (set to 0 to block the request until the build finishes)
+BACKGROUND_BUILD = os.getenv('EMBEDDINGS_BACKGROUND_BUILD', '1').lower() not in ('0', 'false', 'no')
+ENCODE_BATCH_SIZE = int(os.getenv('EMBEDDINGS_BATCH_SIZE', '256'))
+# Batch text search: queries encoded per model call, query rows scored at once
+QUERY_BATCH_SIZE = int(os.getenv('TEXT_BATCH_QUERY_SIZE', '512'))
+SCORE_CHUNK_ROWS = int(os.getenv('TEXT_BATCH_SCORE_ROWS', '64'))
+# serial: encode in this process; parallel: chunked process pool (parallel_embeddings.py)
+BUILD_MODE = os.getenv('EMBEDDINGS_BUILD_MODE', 'serial').lower()
+MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+RETRY_FAILED_BUILD_AFTER = 60.0  # seconds
+
+# Shared encoder; the catalog embeddings live on each engine.Recommender
 model = None
-product_embeddings = None
-df_products = None
+
+# Concurrent cold requests wait for one model load
+_flight = SingleFlight()
+
+def _load_semantic_model_once():
+    global model
+    if model is None:
+        log.info("Loading sentence-transformers model...")
+        with stage('load_semantic_model'):
+            model = SentenceTransformer(MODEL_NAME)
+        log.info("Model loaded successfully!")
+    return model
 
 def load_semantic_model():
     """Load sentence transformer model"""
-    global model
     if model is None:
-        print("Loading sentence-transformers model...")
-        model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-        print("Model loaded successfully!")
+        return _flight.do('model', _load_semantic_model_once)
     return model
 
 def create_product_description(row):
@@ -50,64 +76,219 @@ def create_product_description(row):
     
     return ". ".join(parts)
 
-def build_embeddings(df):
-    """Create embeddings for all products"""
-    global product_embeddings, df_products, model
-    
-    # Load model
-    model = load_semantic_model()
-    
-    # Create description for each product
-    print("Creating product descriptions...")
-    descriptions = []
-    for idx, row in df.iterrows():
-        desc = create_product_description(row)
-        descriptions.append(desc)
-    
-    # Create embeddings
-    print(f"Creating embeddings for {len(descriptions)} products...")
-    product_embeddings = model.encode(descriptions, convert_to_tensor=True, show_progress_bar=True)
-    df_products = df.copy()
-    
-    # Save embeddings for reuse
-    cache_path = "data/embeddings_cache.pkl"
-    os.makedirs("data", exist_ok=True)
-    with open(cache_path, 'wb') as f:
+def build_descriptions(df):
+    """Description for each product, in row order"""
+    # to_dict('records') is much cheaper than iterrows() and yields the same values
+    return [create_product_description(row) for row in df.to_dict('records')]
+
+def encode_descriptions(descriptions, progress=None):
+    """Encode descriptions with the shared model, batch by batch so progress can be reported"""
+    text_model = load_semantic_model()
+    total = len(descriptions)
+    chunks = []
+    for start in range(0, total, ENCODE_BATCH_SIZE):
+        batch = descriptions[start:start + ENCODE_BATCH_SIZE]
+        chunks.append(np.asarray(text_model.encode(batch, show_progress_bar=False), dtype=np.float32))
+        if progress is not None:
+            progress(start + len(batch), total)
+    return np.concatenate(chunks) if chunks else np.zeros((0, 0), dtype=np.float32)
+
+def save_embeddings_cache(path, embeddings, descriptions, df):
+    """Write the embedding cache file (write-then-rename, never a half-written cache)"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with atomic_write(path) as f:
         pickle.dump({
-            'embeddings': product_embeddings,
+            'embeddings': embeddings,
             'descriptions': descriptions,
+            'ids': df['id'].tolist(),
             'df_shape': df.shape
         }, f)
-    print(f"Embeddings saved to {cache_path}")
-    
-    return product_embeddings
 
-def load_or_build_embeddings(df):
-    """Load embeddings from cache or build new ones if not available"""
-    global product_embeddings, df_products
-    
-    cache_path = "data/embeddings_cache.pkl"
+def match_embeddings_cache(path, df):
+    """(embeddings, previous) from a cache file
+
+    embeddings: the cached embeddings if they match df, else None
+    previous: when they do not, (embeddings, row mask of df) for the cached
+              products that still exist, else None
+    """
+    if not os.path.exists(path):
+        return None, None
+    try:
+        with stage('load_embeddings_cache'), open(path, 'rb') as f:
+            cache_data = pickle.load(f)
+    except Exception as e:
+        log.warning("Error loading cache %s: %s", path, e)
+        return None, None
+    ids = cache_data.get('ids')
+    if cache_data['df_shape'] == df.shape and (ids is None or ids == df['id'].tolist()):
+        return cache_data['embeddings'], None
+
+    log.info("Data shape changed, rebuilding embeddings...")
+    if ids is not None:
+        positions = pd.Index(ids).get_indexer(df['id'])
+        keep = positions >= 0
+        if keep.any():
+            return None, (cache_data['embeddings'][positions[keep]], keep)
+    return None, None
+
+def read_embeddings_cache(path, df):
+    """Embeddings from a cache file if it exists and matches df, else None"""
+    return match_embeddings_cache(path, df)[0]
+
+def load_or_encode_catalog(df, cache_path, progress=None):
+    """Embeddings of a catalog: its cache file, or encoded with the shared model
+
+    Nothing is served; engine.Recommender publishes its own embeddings.
+    """
+    embeddings = read_embeddings_cache(cache_path, df)
+    if embeddings is not None:
+        log.info("Embeddings loaded from %s", cache_path)
+        return embeddings
+    with stage('build_descriptions'):
+        descriptions = build_descriptions(df)
+    log.info("Creating embeddings for %d products -> %s", len(descriptions), cache_path)
+    with stage('encode_catalog'):
+        embeddings = encode_descriptions(descriptions, progress)
+    save_embeddings_cache(cache_path, embeddings, descriptions, df)
+    return embeddings
+
+def encode_catalog(descriptions, progress=None, mode=None, parallel_options=None):
+    """Encode a catalog's descriptions
+
+    Args:
+        descriptions: build_descriptions output
+        progress: Optional callback(done, total) called after each batch/chunk
+        mode: 'serial' or 'parallel' (default: EMBEDDINGS_BUILD_MODE)
+        parallel_options: Extra arguments for build_embeddings_parallel
+    """
+    mode = mode or BUILD_MODE
+    log.info("Creating embeddings for %d products (%s)...", len(descriptions), mode)
+    if mode == 'parallel':
+        from parallel_embeddings import build_embeddings_parallel
+        options = {k: v for k, v in (parallel_options or {}).items() if v is not None}
+        dim = load_semantic_model().get_sentence_embedding_dimension()
+        return build_embeddings_parallel(descriptions, MODEL_NAME, dim, progress=progress, **options)
+    return encode_descriptions(descriptions, progress)
+
+def _normalize_rows(matrix, out=None):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    if out is None:
+        out = np.zeros_like(matrix)
+    return np.divide(matrix, norms, out=out, where=norms > 0)
+
+def normalized_rows(embeddings):
+    """Embeddings as float32 with L2-normalized rows, normalized in place when writable
+
+    Cosine similarities (cos_sim) are unchanged by the normalization, and the
+    served catalog keeps no second, unnormalized copy.
+    """
+    matrix = np.asarray(embeddings.cpu() if hasattr(embeddings, 'cpu') else embeddings, dtype=np.float32)
+    if not matrix.flags.writeable:
+        matrix = matrix.copy()
+    return _normalize_rows(matrix, out=matrix)
+
+# ===== Lexical fallback =====
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def _product_terms(row):
+    terms = set()
+    for key in ('brand_name', 'brand_intl_name', 'name', 'intl_name'):
+        val = row.get(key)
+        if isinstance(val, str) and val:
+            terms.add(val.lower())
+            terms.update(t for t in _TOKEN_RE.findall(val.lower()) if len(t) > 1)
+    tags = row.get('flavour_tags')
+    if isinstance(tags, str) and tags:
+        terms.update(t.strip().lower() for t in tags.split('|') if t.strip())
+    return terms
+
+def compute_lexical_index(df):
+    """(df, term -> row positions, term -> idf) over names, brands and flavour tags"""
+    postings = {}
+    for pos, row in enumerate(df.to_dict('records')):
+        for term in _product_terms(row):
+            postings.setdefault(term, []).append(pos)
+    n = max(len(df), 1)
+    postings = {t: np.asarray(p, dtype=np.int64) for t, p in postings.items()}
+    idf = {t: float(np.log(1 + n / len(p))) for t, p in postings.items()}
+    return df, postings, idf
+
+def lexical_search(query, df, top_k=5, index=None):
+    """Rank products by the names/tags that occur in the query.
+
+    Terms are matched as substrings of the query, which also works for
+    Japanese text without spaces. Popularity breaks ties.
+
+    index: compute_lexical_index(df) output (computed on the spot if missing)
+    """
+    if index is None or index[0] is not df:
+        index = compute_lexical_index(df)
+    _, postings, idf = index
+
+    q = query.lower()
+    scores = np.zeros(len(df), dtype=np.float64)
+    for term, positions in postings.items():
+        if term in q:
+            scores[positions] += idf[term]
+    best = scores.max() if len(scores) else 0.0
+    similarity = scores / best if best > 0 else scores
+
+    popularity = np.log1p(df['checkin_count'].to_numpy(dtype=np.float64)) if 'checkin_count' in df else 0
+    order = np.lexsort((-popularity, -scores))[:top_k]
+    return [_build_result(df.iloc[idx], rank, float(similarity[idx]))
+            for rank, idx in enumerate(order)]
+
+# ===== Search =====
+def _build_result(row, rank, similarity_score):
+    # Helper functions to safely process data
+    def safe_get(key, default=None):
+        try:
+            val = row.get(key, default)
+            if pd.notnull(val):
+                if isinstance(val, (np.integer, np.int64)):
+                    return int(val)
+                elif isinstance(val, (np.floating, np.float64)):
+                    return float(val)
+                elif isinstance(val, str):
+                    return str(val)
+                else:
+                    return val
+            return default
+        except:
+            return default
     
-    # Check if cache exists
-    if os.path.exists(cache_path):
+    def safe_split(key):
         try:
-            print("Loading embeddings from cache...")
-            with open(cache_path, 'rb') as f:
-                cache_data = pickle.load(f)
-            
-            # Check if data has changed
-            if cache_data['df_shape'] == df.shape:
-                product_embeddings = cache_data['embeddings']
-                df_products = df.copy()
-                print("Embeddings loaded from cache successfully!")
-                return product_embeddings
-            else:
-                print("Data shape changed, rebuilding embeddings...")
-        except Exception as e:
-            print(f"Error loading cache: {e}")
+            val = safe_get(key, '')
+            if val and isinstance(val, str):
+                return [x.strip() for x in val.split('|') if x.strip()]
+            return []
+        except:
+            return []
     
-    # If no cache or cache is invalid, build new embeddings
-    return build_embeddings(df)
+    return {
+        'rank': int(rank + 1),
+        'similarity_score': round(similarity_score, 4),
+        'id': int(safe_get('id', 0)) if safe_get('id') is not None else None,
+        'brand': safe_get('brand_name'),
+        'brand_intl_name': safe_get('brand_intl_name'),
+        'name': safe_get('name'),
+        'intl_name': safe_get('intl_name'),
+        'score': float(round(float(safe_get('score', 0)), 2)) if safe_get('score') is not None else None,
+        'checkin_count': int(safe_get('checkin_count', 0)) if safe_get('checkin_count') is not None else None,
+        'flavors': {
+            'f1': float(round(float(safe_get('f1', 0)), 3)) if safe_get('f1') is not None else None,
+            'f2': float(round(float(safe_get('f2', 0)), 3)) if safe_get('f2') is not None else None,
+            'f3': float(round(float(safe_get('f3', 0)), 3)) if safe_get('f3') is not None else None,
+            'f4': float(round(float(safe_get('f4', 0)), 3)) if safe_get('f4') is not None else None,
+            'f5': float(round(float(safe_get('f5', 0)), 3)) if safe_get('f5') is not None else None,
+            'f6': float(round(float(safe_get('f6', 0)), 3)) if safe_get('f6') is not None else None
+        },
+        'flavour_tags': safe_split('flavour_tags'),
+        'pictures': safe_split('pictures'),
+        'similar_brands': safe_split('similar_brands'),
+        'year_month': safe_get('year_month'),
+    }
 
 def search_products_by_text(query, df, top_k=5):
     """
@@ -115,89 +296,107 @@ def search_products_by_text(query, df, top_k=5):
     
     Args:
         query: Customer's question or description (e.g., "I want a sweet red wine")
-        df: DataFrame containing product data
+        df: DataFrame containing product data (the default catalog, load_data())
         top_k: Number of products to recommend (default: 5)
     
     Returns:
         List of recommended products with detailed information
     """
-    global product_embeddings, df_products, model
-    
+    results, _ = search_products_by_text_with_mode(query, df, top_k)
+    return results
+
+def search_products_by_text_with_mode(query, df, top_k=5):
+    """
+    Same as search_products_by_text, also returns how the query was served:
+    'semantic', 'stale_embeddings' (previous embedding version while a rebuild
+    runs) or 'lexical' (names/tags fallback while no embeddings exist)
+    """
+    from engine import default_engine
+    return default_engine().search_text(query, top_k)
+
+def semantic_rank(query, embeddings, rows, top_k=5):
+    """Top-k rows of a catalog for a query, by cosine similarity to its embeddings
+
+    embeddings: catalog embeddings with L2-normalized rows, so the cosine is
+    one matrix-vector product; only the top-k are sorted (argpartition)
+    """
     # Load model if not already loaded
-    if model is None:
-        model = load_semantic_model()
-    
-    # Load or create embeddings
-    if product_embeddings is None or df_products is None:
-        load_or_build_embeddings(df)
+    text_model = load_semantic_model()
     
     # Create embedding for query
-    print(f"Processing query: {query}")
-    query_embedding = model.encode(query, convert_to_tensor=True)
+    log.debug("Processing query: %s", query)
+    with stage('encode_query'):
+        query_embedding = np.asarray(text_model.encode([query], convert_to_numpy=True,
+                                                       show_progress_bar=False), dtype=np.float32)
+        query_embedding = _normalize_rows(query_embedding)[0]
     
     # Calculate cosine similarity
-    cos_scores = util.cos_sim(query_embedding, product_embeddings)[0]
-    
-    # Get top_k results
-    top_results = np.argsort(-cos_scores.cpu().numpy())[:top_k]
+    with stage('cos_sim'):
+        cos_scores = np.asarray(embeddings, dtype=np.float32) @ query_embedding
+        
+        # Get top_k results
+        top_results = top_k_rows(cos_scores[None, :], top_k)[0]
     
     # Create results list
     results = []
     for rank, idx in enumerate(top_results):
-        row = df_products.iloc[idx]
         similarity_score = float(cos_scores[idx])
-        
-        # Helper functions to safely process data
-        def safe_get(key, default=None):
-            try:
-                val = row.get(key, default)
-                if pd.notnull(val):
-                    if isinstance(val, (np.integer, np.int64)):
-                        return int(val)
-                    elif isinstance(val, (np.floating, np.float64)):
-                        return float(val)
-                    elif isinstance(val, str):
-                        return str(val)
-                    else:
-                        return val
-                return default
-            except:
-                return default
-        
-        def safe_split(key):
-            try:
-                val = safe_get(key, '')
-                if val and isinstance(val, str):
-                    return [x.strip() for x in val.split('|') if x.strip()]
-                return []
-            except:
-                return []
-        
-        result = {
-            'rank': int(rank + 1),
-            'similarity_score': round(similarity_score, 4),
-            'id': int(safe_get('id', 0)) if safe_get('id') is not None else None,
-            'brand': safe_get('brand_name'),
-            'brand_intl_name': safe_get('brand_intl_name'),
-            'name': safe_get('name'),
-            'intl_name': safe_get('intl_name'),
-            'score': float(round(float(safe_get('score', 0)), 2)) if safe_get('score') is not None else None,
-            'checkin_count': int(safe_get('checkin_count', 0)) if safe_get('checkin_count') is not None else None,
-            'flavors': {
-                'f1': float(round(float(safe_get('f1', 0)), 3)) if safe_get('f1') is not None else None,
-                'f2': float(round(float(safe_get('f2', 0)), 3)) if safe_get('f2') is not None else None,
-                'f3': float(round(float(safe_get('f3', 0)), 3)) if safe_get('f3') is not None else None,
-                'f4': float(round(float(safe_get('f4', 0)), 3)) if safe_get('f4') is not None else None,
-                'f5': float(round(float(safe_get('f5', 0)), 3)) if safe_get('f5') is not None else None,
-                'f6': float(round(float(safe_get('f6', 0)), 3)) if safe_get('f6') is not None else None
-            },
-            'flavour_tags': safe_split('flavour_tags'),
-            'pictures': safe_split('pictures'),
-            'similar_brands': safe_split('similar_brands'),
-            'year_month': safe_get('year_month'),
-        }
+        result = _build_result(rows.iloc[idx], rank, similarity_score)
         results.append(result)
         
-        print(f"{rank+1}. {result['name']} (similarity: {similarity_score:.4f})")
+        log.debug("%d. %s (similarity: %.4f)", rank + 1, result['name'], similarity_score)
     
     return results
+
+# ===== Batch search =====
+def top_k_rows(scores, top_k):
+    """Column indices of the top_k highest scores of every row, highest first"""
+    n_rows, n_cols = scores.shape
+    top_k = max(0, min(top_k, n_cols))
+    if top_k == 0:
+        return np.empty((n_rows, 0), dtype=np.int64)
+    if top_k < n_cols:
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        candidates = np.broadcast_to(np.arange(n_cols), (n_rows, n_cols))
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+def encode_queries(queries):
+    """L2-normalized float32 embeddings of a list of queries (one model call)"""
+    text_model = load_semantic_model()
+    with stage('encode_queries'):
+        embeddings = text_model.encode(list(queries), batch_size=ENCODE_BATCH_SIZE,
+                                       convert_to_numpy=True, show_progress_bar=False)
+        return _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+
+def semantic_rank_batch(queries, embeddings, rows, top_k=5):
+    """
+    semantic_rank for many queries; yields one result list per query, in order
+
+    Queries are encoded QUERY_BATCH_SIZE at a time and scored against the
+    catalog SCORE_CHUNK_ROWS at a time, so memory stays bounded by the chunk
+    size times the catalog size, however many queries there are.
+
+    embeddings: catalog embeddings with L2-normalized rows
+    """
+    products = np.asarray(embeddings, dtype=np.float32)
+    for start in range(0, len(queries), QUERY_BATCH_SIZE):
+        query_embeddings = encode_queries(queries[start:start + QUERY_BATCH_SIZE])
+        for chunk in range(0, len(query_embeddings), SCORE_CHUNK_ROWS):
+            with stage('batch_cos_sim'):
+                scores = query_embeddings[chunk:chunk + SCORE_CHUNK_ROWS] @ products.T
+                top_results = top_k_rows(scores, top_k)
+            for row_scores, row_top in zip(scores, top_results):
+                yield [_build_result(rows.iloc[idx], rank, float(row_scores[idx]))
+                       for rank, idx in enumerate(row_top)]
+
+def search_products_by_text_batch(queries, df, top_k=5):
+    """
+    search_products_by_text_with_mode for many queries
+
+    Returns (results, mode): results is an iterator with one result list per
+    query, produced lazily so callers can stream them.
+    """
+    from engine import default_engine
+    return default_engine().search_text_batch(queries, top_k)
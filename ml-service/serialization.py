@@ -0,0 +1,53 @@
+# serialization.py
+"""
+Fast JSON responses for result records.
+
+CamelJSONResponse converts keys with the precomputed map in utils and encodes
+with orjson when it is installed (stdlib json otherwise). Endpoints return the
+response object directly, so FastAPI skips its own jsonable_encoder pass.
+
+The bytes match Starlette's JSONResponse (compact separators, UTF-8, no ASCII
+escaping) for the values our records contain; orjson and json only differ in
+float exponent notation (|x| < 1e-4 or >= 1e16), which rounded scores,
+similarities and flavors never reach.
+"""
+import json
+from fastapi.responses import JSONResponse
+from utils import convert_keys_to_camel
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+def dumps(content):
+    """Encode to compact UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def ndjson_line(content):
+    """One camelCased NDJSON record (streamed responses)"""
+    return dumps(convert_keys_to_camel(content)) + b"\n"
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with orjson (content must already be JSON-native)"""
+
+    def render(self, content):
+        return dumps(content)
+
+
+class CamelJSONResponse(FastJSONResponse):
+    """FastJSONResponse that converts snake_case keys to camelCase first"""
+
+    def render(self, content):
+        return dumps(convert_keys_to_camel(content))
@@ -0,0 +1,77 @@
+# test_pagination.py
+"""
+Cursor pagination of /recommend/{id}/page against /recommend/{id}.
+
+Runs in-process on the local dataset, no server needed:
+    python test_pagination.py      or      pytest test_pagination.py
+"""
+from fastapi.testclient import TestClient
+
+import app
+from engine import default_engine
+from utils import encode_cursor, decode_cursor
+
+client = TestClient(app.app)
+
+
+def product_ids():
+    engine = default_engine()
+    engine.ensure_loaded()
+    return [int(i) for i in engine.df['id'].iloc[:2]]
+
+
+def get_page(product_id, **params):
+    response = client.get(f"/recommend/{product_id}/page", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_first_page_matches_recommend():
+    product_id = product_ids()[0]
+    expected = client.get(f"/recommend/{product_id}").json()
+    assert get_page(product_id)['results'] == expected
+
+
+def test_pages_continue_ranking():
+    product_id = product_ids()[0]
+    page = get_page(product_id, limit=7)
+    ranks, ids = [], []
+    while True:
+        ranks += [r['rank'] for r in page['results']]
+        ids += [r['id'] for r in page['results']]
+        if page['nextCursor'] is None:
+            break
+        page = get_page(product_id, cursor=page['nextCursor'])
+    assert ranks == list(range(1, page['total'] + 1)), ranks
+    assert len(set(ids)) == len(ids)
+
+
+def test_last_page_has_no_cursor():
+    product_id = product_ids()[0]
+    page = get_page(product_id, limit=50)
+    seen = len(page['results'])
+    while page['nextCursor'] is not None:
+        assert seen < page['total']
+        page = get_page(product_id, cursor=page['nextCursor'])
+        seen += len(page['results'])
+    assert page['results'] and seen == page['total']
+
+
+def test_foreign_cursor_rejected():
+    product_id, other_id = product_ids()
+    cursor = get_page(product_id, limit=5)['nextCursor']
+    assert cursor is not None
+
+    response = client.get(f"/recommend/{other_id}/page", params={'cursor': cursor})
+    assert response.status_code == 400, response.text
+
+    stale = encode_cursor({**decode_cursor(cursor), 'v': 'another-version'})
+    response = client.get(f"/recommend/{product_id}/page", params={'cursor': stale})
+    assert response.status_code == 400, response.text
+
+
+if __name__ == "__main__":
+    for test in [test_first_page_matches_recommend, test_pages_continue_ranking,
+                 test_last_page_has_no_cursor, test_foreign_cursor_rejected]:
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,97 @@
+# test_serialization.py
+"""
+Byte-for-byte compatibility of CamelJSONResponse with the previous output
+(recursive convert_keys_to_camel -> FastAPI jsonable_encoder -> JSONResponse).
+
+Runs in-process on the local dataset, no server needed:
+    python test_serialization.py      or      pytest test_serialization.py
+"""
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from serialization import CamelJSONResponse
+
+
+def legacy_snake_to_camel(s):
+    if not isinstance(s, str):
+        return s
+    parts = s.split('_')
+    if len(parts) == 1:
+        return s
+    return parts[0] + ''.join(p.capitalize() for p in parts[1:])
+
+
+def legacy_convert_keys_to_camel(obj):
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, list):
+        return [legacy_convert_keys_to_camel(v) for v in obj]
+    if isinstance(obj, dict):
+        return {
+            (legacy_snake_to_camel(k) if isinstance(k, str) else k): legacy_convert_keys_to_camel(v)
+            for k, v in obj.items()
+        }
+    return obj
+
+
+def legacy_body(content):
+    """What FastAPI sent before: handler returned convert_keys_to_camel(result)"""
+    return JSONResponse(jsonable_encoder(legacy_convert_keys_to_camel(content))).body
+
+
+def assert_same_bytes(content):
+    expected = legacy_body(content)
+    actual = CamelJSONResponse(content).body
+    assert actual == expected, f"\nexpected: {expected[:300]!r}\nactual:   {actual[:300]!r}"
+
+
+def test_edge_records():
+    """Unicode, None, empty lists, negative/rounded floats, unknown keys"""
+    assert_same_bytes([])
+    assert_same_bytes({'query': 'Tôi muốn rượu vang đỏ ngọt ngào "quoted" \\ \n', 'results': []})
+    assert_same_bytes([{
+        'rank': 1, 'similarity_score': -0.0123, 'id': None, 'brand': '北海道',
+        'brand_intl_name': None, 'score': 4.0, 'checkin_count': 0,
+        'flavors': {'f1': 0.0, 'f2': 1.0, 'f3': 0.123, 'f4': None, 'f5': 0.001, 'f6': 0.5},
+        'flavour_tags': [], 'pictures': ['https://example.com/a b'], 'similar_brands': ['亀齢'],
+        'year_month': 202512, 'some_new_key': True, 'nested_list': [[{'deep_key': 1}]],
+    }])
+
+
+def test_recommend_results():
+    from model import load_data, recommend_by_id
+    df = load_data()
+    ids = df['id'].tolist()
+    for product_id in ids[:: max(1, len(ids) // 20)]:
+        assert_same_bytes(recommend_by_id(int(product_id)))
+
+
+def test_flavor_search_results():
+    from flavor_search import search_by_flavor_profile
+    for vector, weights in [
+        ([0.8, 0.3, None, 0.7, 0.4, 0.5], None),
+        ([None] * 6, None),
+        ([0.1, 0.9, 0.2, 0.0, 1.0, 0.3], [1, 2, 0, 1, 1, 3]),
+    ]:
+        assert_same_bytes(search_by_flavor_profile(vector, 50, weights))
+
+
+def test_text_search_results():
+    pytest.importorskip("sentence_transformers")
+    from model import load_data
+    from semantic_search import search_products_by_text
+    df = load_data()
+    for query in ["I want a sweet red wine", "Rượu sake nhẹ nhàng, dễ uống", "辛口 スッキリ"]:
+        assert_same_bytes({'query': query, 'results': search_products_by_text(query, df, 10)})
+
+
+if __name__ == "__main__":
+    for test in [test_edge_records, test_flavor_search_results,
+                 test_recommend_results, test_text_search_results]:
+        try:
+            test()
+        except pytest.skip.Exception as e:
+            print(f"⏭️  {test.__name__} skipped: {e}")
+            continue
+        print(f"✅ {test.__name__}")
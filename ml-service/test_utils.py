@@ -0,0 +1,120 @@
+# test_utils.py
+"""
+Concurrency guarantees of utils.SingleFlight and utils.atomic_write.
+
+No dataset or server needed:
+    python test_utils.py      or      pytest test_utils.py
+"""
+import os
+import tempfile
+import threading
+import time
+
+from utils import SingleFlight, atomic_write
+
+THREADS = 16
+
+
+def run_concurrently(flight, builder):
+    """Call flight.do('key', builder) from THREADS threads while the builder is
+    held open, so every call overlaps the first one. Returns (results, errors).
+    """
+    release = threading.Event()
+    ready = threading.Barrier(THREADS + 1)
+    results, errors = [], []
+    lock = threading.Lock()
+
+    def held_builder():
+        release.wait(5)
+        return builder()
+
+    def worker():
+        ready.wait()
+        try:
+            value = flight.do('key', held_builder)
+            with lock:
+                results.append(value)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    ready.wait()
+    time.sleep(0.1)  # let the followers reach do() while the leader is held
+    release.set()
+    for t in threads:
+        t.join(5)
+    return results, errors
+
+
+def test_single_flight_shares_result():
+    calls = []
+
+    def builder():
+        calls.append(1)
+        return object()
+
+    results, errors = run_concurrently(SingleFlight(), builder)
+    assert not errors, errors
+    assert len(calls) == 1, f"builder ran {len(calls)} times"
+    assert len(results) == THREADS
+    assert all(r is results[0] for r in results)
+
+
+def test_single_flight_shares_exception():
+    calls = []
+
+    def builder():
+        calls.append(1)
+        raise RuntimeError('build failed')
+
+    results, errors = run_concurrently(SingleFlight(), builder)
+    assert not results, results
+    assert len(calls) == 1, f"builder ran {len(calls)} times"
+    assert len(errors) == THREADS
+    assert all(e is errors[0] and isinstance(e, RuntimeError) for e in errors)
+
+
+def test_single_flight_retries_after_failure():
+    flight = SingleFlight()
+    try:
+        flight.do('key', lambda: 1 / 0)
+    except ZeroDivisionError:
+        pass
+    assert flight.do('key', lambda: 'ok') == 'ok'
+
+
+def test_atomic_write_failure_keeps_old_file():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'cache.pkl')
+        with atomic_write(path) as f:
+            f.write(b'old')
+        try:
+            with atomic_write(path) as f:
+                f.write(b'partial new')
+                raise RuntimeError('crash mid-write')
+        except RuntimeError:
+            pass
+        with open(path, 'rb') as f:
+            assert f.read() == b'old'
+        assert os.listdir(directory) == ['cache.pkl'], os.listdir(directory)
+
+
+def test_atomic_write_follows_umask():
+    mask = os.umask(0o022)
+    os.umask(mask)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'cache.pkl')
+        with atomic_write(path) as f:
+            f.write(b'new')
+        assert os.stat(path).st_mode & 0o777 == 0o666 & ~mask, oct(os.stat(path).st_mode)
+
+
+if __name__ == "__main__":
+    for test in [test_single_flight_shares_result, test_single_flight_shares_exception,
+                 test_single_flight_retries_after_failure, test_atomic_write_failure_keeps_old_file,
+                 test_atomic_write_follows_umask]:
+        test()
+        print(f"✅ {test.__name__}")
@@ -1,5 +1,12 @@
+import base64
+import json
+import os
 import re
-from typing import Any
+import tempfile
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable
 
 
 def snake_to_camel(s: str) -> str:
@@ -12,11 +19,45 @@ def snake_to_camel(s: str) -> str:
     return parts[0] + ''.join(p.capitalize() for p in parts[1:])
 
 
+# Keys produced by the result builders, converted once at import time
+RESULT_KEYS = (
+    'rank', 'id', 'brand', 'brand_intl_name', 'name', 'intl_name', 'score',
+    'checkin_count', 'flavors', 'f1', 'f2', 'f3', 'f4', 'f5', 'f6',
+    'flavour_tags', 'pictures', 'similar_brands', 'year_month',
+    'similarity_score', 'similarity', 'similarity_percent', 'query', 'results',
+    'degraded', 'search_mode', 'total', 'next_cursor',
+)
+CAMEL_KEYS = {k: snake_to_camel(k) for k in RESULT_KEYS}
+
+
+@lru_cache(maxsize=4096)
+def _camel_key_cached(s: str) -> str:
+    return snake_to_camel(s)
+
+
+def camel_key(s: str) -> str:
+    """snake_to_camel with a precomputed map for result keys and a cache for the rest."""
+    camel = CAMEL_KEYS.get(s)
+    if camel is None:
+        camel = _camel_key_cached(s)
+    return camel
+
+
 def convert_keys_to_camel(obj: Any) -> Any:
     """Recursively convert dictionary keys from snake_case to camelCase.
 
     Works for dicts, lists, and leaves other types unchanged.
     """
+    # Fast path on exact types (result records are plain dicts/lists)
+    t = type(obj)
+    if t is dict:
+        return {
+            (camel_key(k) if isinstance(k, str) else k): convert_keys_to_camel(v)
+            for k, v in obj.items()
+        }
+    if t is list:
+        return [convert_keys_to_camel(v) for v in obj]
+
     # Primitive types
     if obj is None or isinstance(obj, (str, int, float, bool)):
         return obj
@@ -29,9 +70,106 @@ def convert_keys_to_camel(obj: Any) -> Any:
     if isinstance(obj, dict):
         new = {}
         for k, v in obj.items():
-            new_key = snake_to_camel(k) if isinstance(k, str) else k
+            new_key = camel_key(k) if isinstance(k, str) else k
             new[new_key] = convert_keys_to_camel(v)
         return new
 
     # Other types (e.g., custom objects) - leave as-is
     return obj
+
+
+def encode_cursor(state: dict) -> str:
+    """Opaque pagination cursor: URL-safe base64 of compact JSON."""
+    raw = json.dumps(state, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Inverse of encode_cursor; ValueError for anything that is not a cursor."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except ValueError:  # bad base64, non-ASCII or bad JSON
+        raise ValueError("Invalid cursor") from None
+    if not isinstance(state, dict):
+        raise ValueError("Invalid cursor")
+    return state
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls: one caller per key runs the builder,
+    the others wait for it and share its result (or its exception).
+    """
+
+    class _Call:
+        __slots__ = ('done', 'result', 'error')
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: Any, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def _read_umask():
+    # os.umask can only be read by setting it; done once at import, before
+    # any worker thread creates files
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# mkstemp creates 0600 files; atomic_write gives them the usual umask mode
+_FILE_MODE = 0o666 & ~_read_umask()
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'wb'):
+    """Write to a temp file in the same directory, then rename over `path`.
+
+    Readers see either the old file or the complete new one, never a partial
+    write, and concurrent writers cannot interleave.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, _FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise